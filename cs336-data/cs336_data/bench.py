@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import argparse
+
+from cs336_data.utils import GOPHER_TOKENIZERS, gopher_filters, normalize_text, normalize_text_regex
+
+
+def read_documents(paths: list[str]) -> list[str]:
+    """Reads one document per file, expanding directories into the files they contain"""
+    documents = []
+    for path in paths:
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+        for file in files:
+            with open(file, "r", errors="replace") as f:
+                documents.append(f.read())
+    return documents
+
+
+def _timed(fn, texts: list[str]) -> tuple[list, float]:
+    start = time.perf_counter()
+    results = [fn(text) for text in texts]
+    return results, time.perf_counter() - start
+
+
+def bench_gopher(texts: list[str], tokenizers: list[str] = list(GOPHER_TOKENIZERS)) -> dict:
+    """Compares the cheap Gopher tokenizers against the NLTK path on speed and keep/reject agreement"""
+    reference, reference_seconds = _timed(lambda t: gopher_filters(t, "nltk"), texts)
+    results = {"docs": len(texts), "nltk": {"seconds": reference_seconds, "kept": sum(reference)}}
+    for tokenizer in tokenizers:
+        decisions, seconds = _timed(lambda t: gopher_filters(t, tokenizer), texts)
+        agree = sum(a == b for a, b in zip(decisions, reference))
+        results[tokenizer] = {
+            "seconds": seconds,
+            "kept": sum(decisions),
+            "speedup": reference_seconds / seconds if seconds > 0 else float("inf"),
+            "agreement": agree / len(texts) if texts else 1.0,
+            "false_keeps": sum(a and not b for a, b in zip(decisions, reference)),
+            "false_rejects": sum(b and not a for a, b in zip(decisions, reference)),
+        }
+    return results
+
+
+def bench_normalize(texts: list[str], repeat: int = 3) -> dict:
+    """Compares the translate-table normalize_text against the regex reference on speed and output"""
+    reference_seconds = seconds = float("inf")
+    for _ in range(repeat):
+        reference, elapsed = _timed(normalize_text_regex, texts)
+        reference_seconds = min(reference_seconds, elapsed)
+        normalized, elapsed = _timed(normalize_text, texts)
+        seconds = min(seconds, elapsed)
+    return {
+        "docs": len(texts),
+        "chars": sum(len(text) for text in texts),
+        "regex_seconds": reference_seconds,
+        "translate_seconds": seconds,
+        "speedup": reference_seconds / seconds if seconds > 0 else float("inf"),
+        "mismatches": sum(a != b for a, b in zip(normalized, reference)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    gopher = subparsers.add_parser("gopher", help="agreement and speed of the cheap Gopher tokenizers against NLTK")
+    gopher.add_argument("paths", nargs="+", help="text files or directories of text files, one document per file")
+    normalize = subparsers.add_parser("normalize", help="speed of the translate-table normalize_text against the regex reference")
+    normalize.add_argument("paths", nargs="+", help="text files or directories of text files, one document per file")
+    normalize.add_argument("--repeat", type=int, default=3, help="best of this many timed runs")
+    args = parser.parse_args()
+
+    if args.benchmark == "gopher":
+        print(json.dumps(bench_gopher(read_documents(args.paths)), indent=2))
+    elif args.benchmark == "normalize":
+        print(json.dumps(bench_normalize(read_documents(args.paths), args.repeat), indent=2))
@@ -0,0 +1,633 @@
+import os
+import math
+import array
+import random
+import tempfile
+import functools
+import itertools
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+import mmh3
+import numpy as np
+
+from cs336_data.minhash import SignatureStore, band_keys, hash_ngrams, minhash_permutations, minhash_signature, ngram_hash_array, nonempty_rows, signature_similarity, sorted_jaccard
+from cs336_data.utils import document_ngrams, normalize_text
+
+
+# Line hashes are stored as unsigned 64-bit words in native byte order; 128-bit hashes are
+# (hi, lo) records, which NumPy sorts and searches lexicographically
+HASH_DTYPES = {
+    64: np.dtype("=u8"),
+    128: np.dtype([("hi", "=u8"), ("lo", "=u8")]),
+}
+CHUNK_LINES = 1 << 20
+
+
+def line_hash(line: str, hash_bits: int = 64) -> tuple[int, ...]:
+    """Returns the unsigned 64-bit words of the hash of `line`, most significant first"""
+    if hash_bits == 64:
+        return (mmh3.hash64(line, signed=False)[0],)
+    h = mmh3.hash128(line, signed=False)
+    return (h >> 64, h & 0xFFFFFFFFFFFFFFFF)
+
+
+def hash_lines(lines: list[str], hash_bits: int = 64) -> np.ndarray:
+    words = array.array("Q")
+    for line in lines:
+        words.extend(line_hash(line, hash_bits))
+    return np.frombuffer(words, dtype=np.uint64).view(HASH_DTYPES[hash_bits])
+
+
+def iter_line_chunks(path: os.PathLike, chunk_lines: int = CHUNK_LINES):
+    with open(path, "r") as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if not lines:
+                return
+            yield lines
+
+
+def hash_partitions(hashes: np.ndarray, num_partitions: int) -> np.ndarray:
+    """Maps each hash to a partition by its top 32 bits, so partitions are contiguous hash ranges"""
+    top = hashes["hi"] if hashes.dtype.names else hashes
+    return ((top >> np.uint64(32)) * np.uint64(num_partitions)) >> np.uint64(32)
+
+
+def split_by_partition(hashes: np.ndarray, num_partitions: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the positions of `hashes` grouped by partition, the grouped hashes and the start
+    offset of every partition's group (plus the end offset of the last one)"""
+    partitions = hash_partitions(hashes, num_partitions)
+    order = np.argsort(partitions, kind="stable")
+    bounds = np.searchsorted(partitions[order], np.arange(num_partitions + 1, dtype=np.uint64))
+    return order, hashes[order], bounds
+
+
+def sorted_contains(sorted_values: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    if len(sorted_values) == 0:
+        return np.zeros(len(queries), dtype=bool)
+    idx = np.searchsorted(sorted_values, queries)
+    idx[idx == len(sorted_values)] = 0
+    return sorted_values[idx] == queries
+
+
+def count_partition(spill_path: str, hash_bits: int) -> np.ndarray:
+    """Returns the sorted hashes that occur more than once in a spilled partition"""
+    hashes = np.fromfile(spill_path, dtype=HASH_DTYPES[hash_bits])
+    unique, counts = np.unique(hashes, return_counts=True)
+    return unique[counts > 1]
+
+
+def duplicate_flags(lines: list[str], duplicates: list[np.ndarray], hash_bits: int) -> np.ndarray:
+    """Flags the lines whose hash is in the per-partition sorted arrays of duplicated hashes"""
+    num_partitions = len(duplicates)
+    order, hashes, bounds = split_by_partition(hash_lines(lines, hash_bits), num_partitions)
+    is_duplicate = np.empty(len(lines), dtype=bool)
+    for p in range(num_partitions):
+        is_duplicate[order[bounds[p]:bounds[p + 1]]] = sorted_contains(duplicates[p], hashes[bounds[p]:bounds[p + 1]])
+    return is_duplicate
+
+
+def filter_lines(path: os.PathLike, output_path: str, duplicates: list[np.ndarray], hash_bits: int):
+    with open(output_path, "w") as out:
+        for lines in iter_line_chunks(path):
+            is_duplicate = duplicate_flags(lines, duplicates, hash_bits)
+            out.writelines(line for line, dup in zip(lines, is_duplicate) if not dup)
+
+
+def find_duplicate_hashes(line_chunks, num_partitions: int, hash_bits: int, work_dir: str) -> list[np.ndarray]:
+    """Counts the lines of `line_chunks` (an iterable of lists of lines) with bounded memory.
+
+    Hashes are spilled to one file per partition in `work_dir` and every partition is counted
+    on its own. Returns, per partition, the sorted duplicated hashes memory-mapped from
+    `work_dir`, which must outlive their use.
+    """
+    spill_paths = [os.path.join(work_dir, f"partition-{p}.bin") for p in range(num_partitions)]
+    spills = [open(spill_path, "wb") for spill_path in spill_paths]
+    try:
+        for lines in line_chunks:
+            _, hashes, bounds = split_by_partition(hash_lines(lines, hash_bits), num_partitions)
+            for p in range(num_partitions):
+                spills[p].write(hashes[bounds[p]:bounds[p + 1]].tobytes())
+    finally:
+        for spill in spills:
+            spill.close()
+
+    duplicates = []
+    for p, spill_path in enumerate(spill_paths):
+        duplicate_path = os.path.join(work_dir, f"duplicates-{p}.npy")
+        np.save(duplicate_path, count_partition(spill_path, hash_bits))
+        os.remove(spill_path)
+        duplicates.append(np.load(duplicate_path, mmap_mode="r"))
+    return duplicates
+
+
+def deduplicate_lines_partitioned(
+    paths: list[os.PathLike],
+    output_dir: os.PathLike,
+    num_partitions: int = 16,
+    hash_bits: int = 64,
+    work_dir: os.PathLike | None = None,
+):
+    """Exact line deduplication with bounded memory, equivalent to utils.deduplicate_lines.
+
+    Lines are hashed to 64 or 128 bits instead of 32, so collisions are negligible even over
+    billions of lines. The first pass spills the hashes to `num_partitions` files in
+    `work_dir`, split by hash prefix, and counts each partition on its own with NumPy, so
+    only one partition has to fit in memory at a time. Only the sorted arrays of duplicated
+    hashes are kept, memory-mapped from disk, for the second pass that writes out the lines
+    occurring exactly once.
+    """
+    if hash_bits not in HASH_DTYPES:
+        raise ValueError(f"hash_bits must be one of {sorted(HASH_DTYPES)}, got {hash_bits}")
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        line_chunks = (lines for path in paths for lines in iter_line_chunks(path))
+        duplicates = find_duplicate_hashes(line_chunks, num_partitions, hash_bits, tmp)
+        for path in paths:
+            filter_lines(path, os.path.join(output_dir, os.path.basename(path)), duplicates, hash_bits)
+
+
+def count_file(path: os.PathLike, partial_prefix: str, num_partitions: int, hash_bits: int) -> list[str]:
+    """Writes the partial count table of one file, one (unique hashes, counts) file per partition"""
+    chunks = [hash_lines(lines, hash_bits) for lines in iter_line_chunks(path)]
+    hashes = np.concatenate(chunks) if chunks else np.empty(0, dtype=HASH_DTYPES[hash_bits])
+    _, hashes, bounds = split_by_partition(hashes, num_partitions)
+    partial_paths = []
+    for p in range(num_partitions):
+        unique, counts = np.unique(hashes[bounds[p]:bounds[p + 1]], return_counts=True)
+        partial_path = f"{partial_prefix}-{p}.npz"
+        np.savez(partial_path, unique=unique, counts=counts)
+        partial_paths.append(partial_path)
+    return partial_paths
+
+
+def merge_partition(partial_paths: list[str], duplicate_path: str) -> str:
+    """Merges the partial counts of one partition across files and saves the duplicated hashes"""
+    uniques, counts = [], []
+    for partial_path in partial_paths:
+        with np.load(partial_path) as partial:
+            uniques.append(partial["unique"])
+            counts.append(partial["counts"])
+    unique = np.concatenate(uniques)
+    counts = np.concatenate(counts)
+    order = np.argsort(unique, kind="stable")
+    unique, counts = unique[order], counts[order]
+    # A hash is duplicated if it occurs twice within one file or in more than one file
+    is_duplicate = counts > 1
+    repeated = unique[1:] == unique[:-1]
+    is_duplicate[1:] |= repeated
+    is_duplicate[:-1] |= repeated
+    np.save(duplicate_path, np.unique(unique[is_duplicate]))
+    return duplicate_path
+
+
+def filter_file(path: os.PathLike, output_path: str, duplicate_paths: list[str], hash_bits: int):
+    filter_lines(path, output_path, [np.load(p, mmap_mode="r") for p in duplicate_paths], hash_bits)
+
+
+def deduplicate_lines_parallel(
+    paths: list[os.PathLike],
+    output_dir: os.PathLike,
+    num_workers: int = os.cpu_count(),
+    num_partitions: int = 16,
+    hash_bits: int = 64,
+    work_dir: os.PathLike | None = None,
+):
+    """Exact line deduplication across a process pool, with the same output as the serial path.
+
+    Workers hash files concurrently into partial per-partition count tables, the tables are
+    merged one partition per task, and the filtering pass writes the outputs one file per
+    task. Speedup is close to linear as long as there are many more files than workers.
+    """
+    if hash_bits not in HASH_DTYPES:
+        raise ValueError(f"hash_bits must be one of {sorted(HASH_DTYPES)}, got {hash_bits}")
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp, ProcessPoolExecutor(max_workers=num_workers) as executor:
+        n = len(paths)
+        partials = list(executor.map(
+            count_file, paths, [os.path.join(tmp, f"file-{i}") for i in range(n)], [num_partitions] * n, [hash_bits] * n
+        ))
+        duplicate_paths = list(executor.map(
+            merge_partition,
+            [[partial[p] for partial in partials] for p in range(num_partitions)],
+            [os.path.join(tmp, f"duplicates-{p}.npy") for p in range(num_partitions)],
+        ))
+        list(executor.map(
+            filter_file,
+            paths,
+            [os.path.join(output_dir, os.path.basename(path)) for path in paths],
+            [duplicate_paths] * n,
+            [hash_bits] * n,
+        ))
+
+
+def bloom_parameters(num_items: int, false_positive_rate: float = 0.001, memory_bytes: int | None = None) -> tuple[int, int]:
+    """Returns the (num_bits, num_hashes) of a Bloom filter holding `num_items`.
+
+    The filter is sized for `false_positive_rate`, or, with `memory_bytes`, given that many
+    bytes and the number of hash functions that minimizes the false positive rate.
+    """
+    num_items = max(num_items, 1)
+    if memory_bytes is not None:
+        num_bits = memory_bytes * 8
+    else:
+        num_bits = math.ceil(-num_items * math.log(false_positive_rate) / math.log(2) ** 2)
+    num_hashes = max(1, round(num_bits / num_items * math.log(2)))
+    return num_bits, num_hashes
+
+
+class BloomFilter:
+    """Bit-array Bloom filter over 128-bit line hashes, probed with double hashing"""
+
+    def __init__(self, num_bits: int, num_hashes: int):
+        self.num_bits = max(8, num_bits)
+        self.num_hashes = num_hashes
+        self.bits = np.zeros(-(-self.num_bits // 8), dtype=np.uint8)
+        self._steps = np.arange(num_hashes, dtype=np.uint64)
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        # Kirsch-Mitzenmacher: the i-th probe of a hash (h1, h2) is h1 + i * h2; an odd h2
+        # keeps the probes of one item distinct
+        with np.errstate(over="ignore"):
+            positions = hashes["hi"][:, None] + self._steps[None, :] * (hashes["lo"][:, None] | np.uint64(1))
+        return positions % np.uint64(self.num_bits)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        positions = self._positions(hashes)
+        probed = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return probed.all(axis=1)
+
+    def add(self, hashes: np.ndarray):
+        positions = self._positions(hashes).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def false_positive_rate(self) -> float:
+        """Probability that an absent item is reported present, from the current fill ratio"""
+        fill = np.unpackbits(self.bits).sum() / (len(self.bits) * 8)
+        return float(fill ** self.num_hashes)
+
+
+def count_lines(paths: list[os.PathLike]) -> int:
+    count = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            count += sum(1 for _ in f)
+    return count
+
+
+def deduplicate_lines_bloom(
+    paths: list[os.PathLike],
+    output_dir: os.PathLike,
+    false_positive_rate: float = 0.001,
+    memory_bytes: int | None = None,
+    expected_lines: int | None = None,
+) -> dict:
+    """Approximate exact line deduplication in fixed memory with a pair of Bloom filters.
+
+    The first pass inserts every line into a "seen once" filter, and into a "seen twice"
+    filter if it was already in the first one; the second pass drops the lines found in the
+    "seen twice" filter. False positives only ever remove lines, never keep duplicates: a
+    line occurring once is wrongly removed if it is a false positive of "seen once" when
+    inserted or of "seen twice" when filtered.
+
+    Both filters are sized for `expected_lines` (counted with an extra pass over the input
+    if not given) and `false_positive_rate`, or split `memory_bytes` between them. Returns
+    the filter parameters, the measured false positive rates of both filters and their sum,
+    an upper bound on the expected fraction of unique lines removed.
+    """
+    if expected_lines is None:
+        expected_lines = count_lines(paths)
+    num_bits, num_hashes = bloom_parameters(
+        expected_lines, false_positive_rate, memory_bytes // 2 if memory_bytes is not None else None
+    )
+    seen_once, seen_twice = BloomFilter(num_bits, num_hashes), BloomFilter(num_bits, num_hashes)
+    for path in paths:
+        for lines in iter_line_chunks(path):
+            hashes = hash_lines(lines, 128)
+            # Lines repeated within the chunk are seen twice even if the filter missed them
+            _, inverse, counts = np.unique(hashes, return_inverse=True, return_counts=True)
+            repeated = (counts[inverse] > 1) | seen_once.contains(hashes)
+            seen_twice.add(hashes[repeated])
+            seen_once.add(hashes)
+
+    for path in paths:
+        with open(os.path.join(output_dir, os.path.basename(path)), "w") as out:
+            for lines in iter_line_chunks(path):
+                is_duplicate = seen_twice.contains(hash_lines(lines, 128))
+                out.writelines(line for line, dup in zip(lines, is_duplicate) if not dup)
+
+    once_rate, twice_rate = seen_once.false_positive_rate(), seen_twice.false_positive_rate()
+    return {
+        "expected_lines": expected_lines,
+        "num_bits": seen_once.num_bits,
+        "num_hashes": num_hashes,
+        "memory_bytes": len(seen_once.bits) + len(seen_twice.bits),
+        "false_positive_rate_once": once_rate,
+        "false_positive_rate_twice": twice_rate,
+        "expected_over_removal_rate": min(1.0, once_rate + twice_rate),
+    }
+
+
+class UnionFind:
+    """Disjoint sets over the integers 0..n-1 with path compression and union by size"""
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x: int, y: int) -> bool:
+        """Merges the sets of x and y, returning False if they already were the same set"""
+        x, y = self.find(x), self.find(y)
+        if x == y:
+            return False
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+        self.parent[y] = x
+        self.size[x] += self.size[y]
+        return True
+
+    def clusters(self) -> list[list[int]]:
+        """Returns the sets with more than one member, each sorted, ordered by smallest member"""
+        members = {}
+        for x in range(len(self.parent)):
+            members.setdefault(self.find(x), []).append(x)
+        return [cluster for cluster in members.values() if len(cluster) > 1]
+
+
+def cluster_representatives(union_find: UnionFind, seed: int = 0) -> set[int]:
+    """Picks one member of every cluster to keep, reproducibly for a given seed"""
+    rng = random.Random(seed)
+    return {rng.choice(cluster) for cluster in union_find.clusters()}
+
+
+def ngram_array_loader(ngram_length: int, cache_size: int = 1024):
+    """Returns a function reading the sorted n-gram hash array of a normalized document,
+    LRU-cached by path"""
+    @functools.lru_cache(maxsize=cache_size)
+    def load(path: os.PathLike) -> np.ndarray:
+        with open(path, "r") as f:
+            return ngram_hash_array(normalize_text(f.read()), ngram_length)
+    return load
+
+
+def sign_documents(paths: list[os.PathLike], num_hashes: int, ngram_length: int, seed: int = 0) -> np.ndarray:
+    """Returns the (len(paths), num_hashes) MinHash signatures of the normalized documents"""
+    permutations = minhash_permutations(num_hashes, seed)
+    signatures = np.empty((len(paths), num_hashes), dtype=np.uint64)
+    for i, path in enumerate(paths):
+        with open(path, "r") as f:
+            ngrams = document_ngrams(normalize_text(f.read()), ngram_length)
+        signatures[i] = minhash_signature(hash_ngrams(ngrams), permutations)
+    return signatures
+
+
+def first_shared_band(a: np.ndarray, b: np.ndarray, band: int) -> bool:
+    """Whether two rows of per-band values, e.g. band_keys or signatures reshaped to
+    (num_bands, rows_per_band), differ on every band before `band`"""
+    return bool((a[:band] != b[:band]).reshape(band, -1).any(axis=1).all()) if band else True
+
+
+def lsh_candidate_pairs(band_signatures: np.ndarray, rows_per_band: int, union_find: UnionFind | None = None):
+    """Yields the pairs of rows that agree on at least one band of `band_signatures`.
+
+    Pairs are generated lazily, one bucket at a time, so a bucket of k rows never holds its
+    k * (k - 1) / 2 pairs in memory. A pair is only yielded from the first band it shares,
+    so without a global set of pairs it is still verified once. With a `union_find`, pairs
+    already in one cluster are skipped before that check. Rows of empty documents are left
+    out, see nonempty_rows.
+    """
+    num_bands = band_signatures.shape[1] // rows_per_band
+    bands = band_signatures[:, :num_bands * rows_per_band].reshape(len(band_signatures), num_bands, rows_per_band)
+    nonempty = nonempty_rows(band_signatures).tolist()
+    for band in range(num_bands):
+        bucket = {}
+        for i in nonempty:
+            bucket.setdefault(bands[i, band].tobytes(), []).append(i)
+        for rows in bucket.values():
+            for i, j in itertools.combinations(rows, 2):
+                if union_find is not None and union_find.find(i) == union_find.find(j):
+                    continue
+                if first_shared_band(bands[i], bands[j], band):
+                    yield i, j
+
+
+def verify_pairs(pairs, paths: list[os.PathLike], signatures: np.ndarray, ngram_length: int, threshold: float, estimate_jaccard: bool = False, cache_size: int = 1024, union_find: UnionFind | None = None, ngram_array=None) -> list[tuple[int, int]]:
+    """Returns the candidate pairs (any iterable, consumed lazily) whose Jaccard similarity
+    reaches `threshold`.
+
+    Similarity is exact over sorted n-gram hash arrays read through an LRU cache of
+    `cache_size` documents, or, with `estimate_jaccard`, the fraction of equal MinHash
+    values. With a `union_find`, verified pairs are unioned as they are found and pairs
+    already in one cluster skipped, so a bucket of k duplicates costs k - 1 verifications.
+    `ngram_array` replaces the reader of the n-gram array of `paths[i]`, for documents that
+    are not files.
+    """
+    if ngram_array is None:
+        ngram_array = ngram_array_loader(ngram_length, cache_size)
+    verified = []
+    for i, j in pairs:
+        if union_find is not None and union_find.find(i) == union_find.find(j):
+            continue
+        if estimate_jaccard:
+            similarity = signature_similarity(signatures[i], signatures[j])
+        else:
+            similarity = sorted_jaccard(ngram_array(paths[i]), ngram_array(paths[j]))
+        if similarity >= threshold:
+            verified.append((i, j))
+            if union_find is not None:
+                union_find.union(i, j)
+    return verified
+
+
+def write_cluster_representatives(all_paths: list[os.PathLike], union_find: UnionFind, output_dir: os.PathLike, seed: int = 0):
+    representatives = cluster_representatives(union_find, seed)
+    keep = [path for i, path in enumerate(all_paths) if union_find.size[union_find.find(i)] == 1 or i in representatives]
+
+    for path in keep:
+        with open(path, "r") as f:
+            with open(output_dir / path.name, "w") as out:
+                out.write(f.read())
+
+
+def deduplicate_fuzzy(all_paths: list[os.PathLike], num_hashes: int, num_bands: int, ngram_length: int, output_dir: os.PathLike, threshold: float, seed: int = 0, estimate_jaccard: bool = False, cache_size: int = 1024):
+    """MinHash LSH near-duplicate removal, keeping one document per cluster.
+
+    Candidate pairs are streamed bucket by bucket into verification, each from the first
+    band it shares only, and pairs already joined in one cluster are skipped. Pairs are
+    verified by exact Jaccard over sorted n-gram hash arrays read through an LRU cache of
+    `cache_size` documents, or, with `estimate_jaccard`, by the fraction of equal MinHash
+    values without reading the documents again.
+    """
+    rows_per_band = num_hashes // num_bands
+    signatures = sign_documents(all_paths, num_hashes, ngram_length, seed)
+    union_find = UnionFind(len(all_paths))
+    candidates = lsh_candidate_pairs(signatures[:, :num_bands * rows_per_band], rows_per_band, union_find)
+    verify_pairs(candidates, all_paths, signatures, ngram_length, threshold, estimate_jaccard, cache_size, union_find)
+    write_cluster_representatives(all_paths, union_find, output_dir, seed)
+
+
+# Directory of the band keys and signatures shared with verification workers through memory maps
+_shared_dir = None
+
+
+def _init_shared_dir(path: str):
+    global _shared_dir
+    _shared_dir = path
+
+
+@functools.lru_cache(maxsize=2)
+def _load_shared(name: str) -> np.ndarray:
+    return np.load(os.path.join(_shared_dir, name), mmap_mode="r")
+
+
+def lsh_buckets(keys: np.ndarray, rows: np.ndarray | None = None):
+    """Yields, band by band, (band, row indices) of every bucket of at least two rows of `keys`, as from band_keys.
+
+    Only `rows` are bucketed if given, e.g. the nonempty_rows of the signatures.
+    """
+    if rows is None:
+        rows = np.arange(len(keys))
+    for band, column in enumerate(keys[rows].T):
+        order = np.argsort(column, kind="stable")
+        bounds = np.flatnonzero(np.diff(column[order])) + 1
+        for bucket in np.split(rows[order], bounds):
+            if len(bucket) > 1:
+                yield band, bucket
+
+
+def _verify_buckets(buckets: list[tuple[int, np.ndarray]], paths: dict[int, os.PathLike] | None, ngram_length: int, threshold: float, estimate_jaccard: bool, cache_size: int) -> list[tuple[int, int]]:
+    """verify_pairs over the pairs of every (band, bucket) that share no earlier band, with
+    rows renumbered to the chunk"""
+    rows = np.unique(np.concatenate([bucket for _, bucket in buckets])).tolist()
+    local = {row: k for k, row in enumerate(rows)}
+    keys = _load_shared("band_keys.npy")[rows]
+    signatures = _load_shared("signatures.npy")[rows] if estimate_jaccard else None
+    local_paths = None if estimate_jaccard else [paths[row] for row in rows]
+    pairs = (
+        (local[i], local[j])
+        for band, bucket in buckets
+        for i, j in itertools.combinations(bucket.tolist(), 2)
+        if first_shared_band(keys[local[i]], keys[local[j]], band)
+    )
+    verified = verify_pairs(pairs, local_paths, signatures, ngram_length, threshold, estimate_jaccard, cache_size, UnionFind(len(rows)))
+    return [(rows[i], rows[j]) for i, j in verified]
+
+
+def deduplicate_fuzzy_parallel(all_paths: list[os.PathLike], num_hashes: int, num_bands: int, ngram_length: int, output_dir: os.PathLike, threshold: float, seed: int = 0, estimate_jaccard: bool = False, cache_size: int = 1024, num_workers: int = os.cpu_count(), chunk_rows: int = 4096):
+    """deduplicate_fuzzy across a process pool.
+
+    Documents are signed in chunks across workers. The calling process then computes the
+    band keys and walks the LSH buckets band by band, streaming chunks of about
+    `chunk_rows` bucket rows to the workers with the paths of the chunk's rows for exact
+    verification. Bucketing is one sort per band, cheap next to verification, so band
+    tables are not sharded across workers. With `estimate_jaccard` workers read signatures
+    from a memory-mapped copy shared through the pool initializer instead. Workers read the
+    band keys the same way, to verify a pair only from the first band it shares. Only the
+    verified pairs, at most one per row and chunk, come back to be unioned, so the kept
+    clusters match deduplicate_fuzzy.
+    """
+    n = len(all_paths)
+    with tempfile.TemporaryDirectory() as tmp:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_shared_dir, initargs=(tmp,)) as executor:
+            path_chunks = [all_paths[i:i + max(1, n // num_workers)] for i in range(0, n, max(1, n // num_workers))]
+            signed = executor.map(sign_documents, path_chunks, itertools.repeat(num_hashes), itertools.repeat(ngram_length), itertools.repeat(seed))
+            signatures = np.concatenate(list(signed)) if n else np.empty((0, num_hashes), dtype=np.uint64)
+            keys = band_keys(signatures, num_bands)
+            np.save(os.path.join(tmp, "band_keys.npy"), keys)
+            if estimate_jaccard:
+                np.save(os.path.join(tmp, "signatures.npy"), signatures)
+
+            union_find = UnionFind(n)
+            pending = set()
+
+            def submit(buckets):
+                paths = None if estimate_jaccard else {row: all_paths[row] for _, bucket in buckets for row in bucket.tolist()}
+                pending.add(executor.submit(_verify_buckets, buckets, paths, ngram_length, threshold, estimate_jaccard, cache_size))
+
+            def union_completed(return_when):
+                nonlocal pending
+                done, pending = wait(pending, return_when=return_when)
+                for future in done:
+                    for i, j in future.result():
+                        union_find.union(i, j)
+
+            buckets, num_rows = [], 0
+            for band, rows in lsh_buckets(keys, nonempty_rows(signatures)):
+                buckets.append((band, rows))
+                num_rows += len(rows)
+                if num_rows >= chunk_rows:
+                    if len(pending) >= 2 * num_workers:
+                        union_completed(FIRST_COMPLETED)
+                    submit(buckets)
+                    buckets, num_rows = [], 0
+            if buckets:
+                submit(buckets)
+            if pending:
+                union_completed(ALL_COMPLETED)
+    write_cluster_representatives(all_paths, union_find, output_dir, seed)
+
+
+def deduplicate_fuzzy_incremental(new_paths: list[os.PathLike], store_dir: os.PathLike, output_dir: os.PathLike, num_hashes: int, num_bands: int, ngram_length: int, threshold: float, seed: int = 0, estimate_jaccard: bool = False, cache_size: int = 1024, keep_ngrams: bool = False) -> list[os.PathLike]:
+    """Fuzzy-deduplicates a new batch of documents against a SignatureStore of earlier batches.
+
+    Only the new documents are read and signed. A new document is dropped if it is a near
+    duplicate of a stored document or of an earlier document of the same batch, verified as
+    in deduplicate_fuzzy. The kept documents are copied to `output_dir` and appended to the
+    store under their absolute output path, so the next batch is checked against them.
+    Exact verification reads earlier outputs back from there, unless the store was created
+    with `keep_ngrams` (see SignatureStore for the tradeoff). Estimation never needs the
+    n-grams, so `keep_ngrams` is ignored with `estimate_jaccard`. Returns the kept input paths.
+    """
+    keep_ngrams = keep_ngrams and not estimate_jaccard
+    store = SignatureStore(store_dir, num_hashes, num_bands, ngram_length, seed, keep_ngrams)
+    signatures = sign_documents(new_paths, num_hashes, ngram_length, seed)
+    keys = band_keys(signatures, num_bands)
+
+    ngram_array = ngram_array_loader(ngram_length, cache_size)
+    stored_signatures = store.signatures
+
+    def is_duplicate_of_stored(i: int, row: int) -> bool:
+        if estimate_jaccard:
+            return signature_similarity(signatures[i], stored_signatures[row]) >= threshold
+        stored = store.ngram_array(row) if keep_ngrams else ngram_array(store.paths[row])
+        return sorted_jaccard(ngram_array(new_paths[i]), stored) >= threshold
+
+    def is_duplicate_of_new(i: int, j: int) -> bool:
+        if estimate_jaccard:
+            return signature_similarity(signatures[i], signatures[j]) >= threshold
+        return sorted_jaccard(ngram_array(new_paths[i]), ngram_array(new_paths[j])) >= threshold
+
+    nonempty = nonempty_rows(signatures).tolist()
+    stored_candidates = dict(zip(nonempty, store.candidates(keys[nonempty])))
+    kept = []
+    buckets = [{} for _ in range(num_bands)]
+    for i in range(len(new_paths)):
+        # Empty documents are kept unchecked and never become candidates, see nonempty_rows
+        if i not in stored_candidates:
+            kept.append(i)
+            continue
+        if any(is_duplicate_of_stored(i, row) for row in sorted(stored_candidates[i])):
+            continue
+        earlier = {j for band in range(num_bands) for j in buckets[band].get(keys[i, band], ())}
+        if any(is_duplicate_of_new(i, j) for j in sorted(earlier)):
+            continue
+        kept.append(i)
+        for band in range(num_bands):
+            buckets[band].setdefault(keys[i, band], []).append(i)
+
+    output_paths = [os.path.join(output_dir, os.path.basename(new_paths[i])) for i in kept]
+    ngram_arrays = []
+    for i, output_path in zip(kept, output_paths):
+        with open(new_paths[i], "r") as f:
+            text = f.read()
+        with open(output_path, "w") as out:
+            out.write(text)
+        if keep_ngrams:
+            ngram_arrays.append(ngram_hash_array(normalize_text(text), ngram_length))
+    store.add(output_paths, signatures[kept], keys[kept], ngram_arrays)
+    return [new_paths[i] for i in kept]
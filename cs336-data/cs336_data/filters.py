@@ -0,0 +1,258 @@
+import json
+import time
+from urllib.parse import urlsplit
+from fastwarc.warc import WarcRecordType
+
+from cs336_data.profiling import PipelineStats
+from cs336_data.utils import DEFAULT_CLASSIFIERS, classify_batch, gopher_filters, mask_pii as mask_all_pii
+
+
+def _rank(seconds: float, rejected: int) -> float:
+    # Mean cost divided by rejection rate, i.e. seconds spent per rejected document
+    return seconds / rejected if rejected else float("inf")
+
+
+class FilterStage:
+    """One filter of a FilterChain along with the runtime statistics used to order it.
+
+    `fn` takes the raw and the newline-normalized texts of a batch and returns one keep flag
+    per text, or a tuple of the keep flags and one score per text.
+    """
+
+    def __init__(self, name: str, fn):
+        self.name = name
+        self.fn = fn
+        self.docs = 0
+        self.rejected = 0
+        self.seconds = 0.0
+
+    def __call__(self, contents: list[str], normalized: list[str]) -> tuple[list[bool], list[float] | None]:
+        start = time.perf_counter()
+        keep = self.fn(contents, normalized)
+        self.seconds += time.perf_counter() - start
+        keep, scores = keep if isinstance(keep, tuple) else (keep, None)
+        self.docs += len(contents)
+        self.rejected += len(contents) - sum(keep)
+        return keep, scores
+
+    @property
+    def cost(self) -> float:
+        """Mean seconds per document"""
+        return self.seconds / self.docs if self.docs else 0.0
+
+    @property
+    def rejection_rate(self) -> float:
+        return self.rejected / self.docs if self.docs else 0.0
+
+    def stats(self) -> dict:
+        return {"docs": self.docs, "rejected": self.rejected, "seconds": self.seconds}
+
+    def load_stats(self, stats: dict):
+        self.docs = stats["docs"]
+        self.rejected = stats["rejected"]
+        self.seconds = stats["seconds"]
+
+
+def classifier_stage(model: str, accept: str | None, min_score: float) -> FilterStage:
+    """A scoring stage keeping documents labeled `accept` with at least `min_score`; an
+    `accept` of None only records scores and never rejects"""
+    def fn(contents, normalized):
+        preds = classify_batch(normalized, model, normalized=True)
+        return [accept is None or (label == accept and score >= min_score) for label, score in preds], [score for _, score in preds]
+    return FilterStage(model, fn)
+
+
+def gopher_stage(tokenizer: str = "nltk") -> FilterStage:
+    return FilterStage("gopher", lambda contents, normalized: [gopher_filters(c, tokenizer) for c in contents])
+
+
+class FilterChain:
+    """Runs filter stages in sequence, passing only surviving documents to the next stage.
+
+    Since most documents are rejected somewhere in the chain, throughput depends on running
+    cheap, high-rejection stages first. With `adaptive` set, the chain reorders its stages
+    every `reorder_interval` documents by expected cost per rejected document, i.e. mean
+    cost divided by rejection rate, once every stage has seen `min_samples` documents.
+    Stage statistics can be saved to and seeded from a JSON profile. If `stats` is given,
+    every stage is also timed into it.
+
+    If `scores` is given, one dict per document, the scores of scoring stages are recorded
+    in it under the stage name for the documents the stage saw.
+    """
+
+    def __init__(self, stages: list[FilterStage], adaptive: bool = True, reorder_interval: int = 1000, min_samples: int = 100, stats: PipelineStats | None = None):
+        self.stages = list(stages)
+        self.stats = stats
+        self.adaptive = adaptive
+        self.reorder_interval = reorder_interval
+        self.min_samples = min_samples
+        self._since_reorder = 0
+
+    def __call__(self, contents: list[str], scores: list[dict] | None = None) -> list[bool]:
+        alive = list(range(len(contents)))
+        normalized = [text.replace("\n", " ") for text in contents]
+        for stage in self.stages:
+            if not alive:
+                break
+            if self.stats is None:
+                keep, stage_scores = stage([contents[i] for i in alive], [normalized[i] for i in alive])
+            else:
+                with self.stats.stage(f"filter:{stage.name}", len(alive)):
+                    keep, stage_scores = stage([contents[i] for i in alive], [normalized[i] for i in alive])
+                self.stats.reject(f"filter:{stage.name}", len(alive) - sum(keep))
+            if scores is not None and stage_scores is not None:
+                for i, score in zip(alive, stage_scores):
+                    scores[i][stage.name] = score
+            alive = [i for i, k in zip(alive, keep) if k]
+        self._since_reorder += len(contents)
+        if self.adaptive and self._since_reorder >= self.reorder_interval:
+            self.reorder()
+        alive = set(alive)
+        return [i in alive for i in range(len(contents))]
+
+    def reorder(self):
+        self._since_reorder = 0
+        if any(stage.docs < self.min_samples for stage in self.stages):
+            return
+        self.stages.sort(key=lambda s: _rank(s.seconds, s.rejected))
+
+    def order(self) -> list[str]:
+        return [stage.name for stage in self.stages]
+
+    def profile(self) -> dict:
+        return {"order": self.order(), "stages": {stage.name: stage.stats() for stage in self.stages}}
+
+    def load_profile(self, profile: dict):
+        """Seeds stage statistics and order from a profile, ignoring stages not in this chain"""
+        stages = {stage.name: stage for stage in self.stages}
+        for name, stats in profile["stages"].items():
+            if name in stages:
+                stages[name].load_stats(stats)
+        rank = {name: i for i, name in enumerate(profile["order"])}
+        self.stages.sort(key=lambda s: rank.get(s.name, len(rank)))
+
+    def save_profile(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.profile(), f, indent=2)
+
+
+def merge_profiles(profiles: list[dict], base: dict | None = None) -> dict:
+    """Sums stage statistics across profiles, e.g. from the workers of a parallel run.
+
+    If every profile was seeded from `base`, its statistics are counted only once.
+    """
+    stages = {}
+    for profile in profiles:
+        for name, stats in profile["stages"].items():
+            seed = base["stages"].get(name) if base is not None else None
+            merged = stages.setdefault(name, dict(seed) if seed else {"docs": 0, "rejected": 0, "seconds": 0.0})
+            for key in merged:
+                merged[key] += stats[key] - (seed[key] if seed else 0)
+    rank = lambda name: _rank(stages[name]["seconds"], stages[name]["rejected"])
+    return {"order": sorted(stages, key=rank), "stages": stages}
+
+
+def build_filter_chain(identify: bool, classify: bool, gopher: bool, profile: dict | None = None, adaptive: bool = True, stats: PipelineStats | None = None, gopher_tokenizer: str = "nltk") -> FilterChain:
+    stages = [
+        classifier_stage(*c) for c in DEFAULT_CLASSIFIERS
+        if (c[0] == "lang" and identify) or (c[0] != "lang" and classify)
+    ]
+    if gopher:
+        stages.append(gopher_stage(gopher_tokenizer))
+    chain = FilterChain(stages, adaptive=adaptive, stats=stats)
+    if profile is not None:
+        chain.load_profile(profile)
+    return chain
+
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+
+def filter_batch(contents: list[str], chain: FilterChain, mask_pii: bool, stats: PipelineStats | None = None, metadata: list[dict] | None = None) -> list[str | None]:
+    """Runs the filter chain on a batch of extracted documents.
+
+    Returns, in input order, the (possibly PII-masked) content of each kept document or
+    None for rejected ones. Each stage of the chain only sees the documents that survived
+    the previous one. If `metadata` is given, one dict per document, the classifier scores
+    and PII counts of each document are stored in it under "scores" and "pii".
+    """
+    scores = [{} for _ in contents] if metadata is not None else None
+    keep = [i for i, ok in enumerate(chain(contents, scores)) if ok]
+    results = [None] * len(contents)
+    for i in keep:
+        content = contents[i]
+        counts = {}
+        if mask_pii:
+            if stats is None:
+                content, counts = mask_all_pii(content)
+            else:
+                with stats.stage("mask_pii"):
+                    content, counts = mask_all_pii(content)
+                for name, count in counts.items():
+                    stats.count(f"pii:{name}", count)
+            if sum(counts.values()) == 0:
+                if stats is not None:
+                    stats.reject("mask_pii")
+                continue
+        if metadata is not None:
+            metadata[i]["scores"] = scores[i]
+            metadata[i]["pii"] = counts
+        results[i] = content
+    return results
+
+
+def load_blocklist(path: str) -> set[str]:
+    """Reads one domain per line, skipping blank lines and # comments"""
+    with open(path) as f:
+        return {line.strip().lower() for line in f if line.strip() and not line.startswith("#")}
+
+
+class RecordFilter:
+    """Rejects WARC records on their WARC and HTTP headers alone, before the payload is read.
+
+    Records are rejected for a WARC type not in `record_types`, an HTTP status not in
+    `statuses`, a Content-Type not in `content_types` (records without one are kept), a
+    Content-Length above `max_content_length`, or a target URI whose host or any parent
+    domain is in `blocked_domains`.
+    """
+
+    def __init__(
+        self,
+        record_types: WarcRecordType = WarcRecordType.response,
+        content_types: tuple[str, ...] | None = HTML_CONTENT_TYPES,
+        statuses: tuple[int, ...] | None = (200,),
+        max_content_length: int | None = None,
+        blocked_domains: set[str] = frozenset(),
+    ):
+        # Kept as an int bitmask: WarcRecordType itself cannot be pickled to pool workers
+        self.record_types = int(record_types)
+        self.content_types = content_types
+        self.statuses = statuses
+        self.max_content_length = max_content_length
+        self.blocked_domains = {domain.lower() for domain in blocked_domains}
+
+    def is_blocked(self, url: str | None) -> bool:
+        if not self.blocked_domains or not url:
+            return False
+        host = urlsplit(url).hostname or ""
+        parts = host.split(".")
+        return any(".".join(parts[i:]) in self.blocked_domains for i in range(len(parts)))
+
+    def reject_reason(self, record) -> str | None:
+        """Returns why `record` is rejected, or None to keep it"""
+        if not int(record.record_type) & self.record_types:
+            return "record_type"
+        if self.max_content_length is not None and record.content_length > self.max_content_length:
+            return "content_length"
+        if self.is_blocked(record.headers.get("WARC-Target-URI")):
+            return "blocked_domain"
+        http = record.http_headers
+        if http is None:
+            return None
+        if self.statuses is not None and http.status_code not in self.statuses:
+            return "status"
+        content_type = http.get("Content-Type")
+        if self.content_types is not None and content_type:
+            if content_type.split(";", 1)[0].strip().lower() not in self.content_types:
+                return "content_type"
+        return None
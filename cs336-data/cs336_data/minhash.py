@@ -0,0 +1,217 @@
+import os
+import json
+import mmh3
+import numpy as np
+
+
+# Universal hashing h(x) = (a * x + b) mod p over 32-bit n-gram hashes. With a, b < 2^32 the
+# product and sum stay below 2^64, so the arithmetic is exact in uint64.
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+EMPTY_SIGNATURE_VALUE = np.iinfo(np.uint64).max
+BLOCK_SIZE = 4096
+
+
+def minhash_permutations(num_hashes: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Draws the (a, b) coefficients of `num_hashes` universal hash functions"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, size=num_hashes, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=num_hashes, dtype=np.uint64)
+    return a, b
+
+
+def hash_ngrams(ngrams: list[str]) -> np.ndarray:
+    """Hashes every distinct n-gram once to an unsigned 32-bit value"""
+    unique = set(ngrams)
+    return np.fromiter((mmh3.hash(ngram, signed=False) for ngram in unique), dtype=np.uint64, count=len(unique))
+
+
+def minhash_signature(ngram_hashes: np.ndarray, permutations: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Returns the uint64 MinHash signature of one document, one value per permutation.
+
+    The n-gram hashes are permuted in blocks of BLOCK_SIZE so that the intermediate matrix
+    stays small for long documents. Documents without n-grams get EMPTY_SIGNATURE_VALUE.
+    """
+    a, b = permutations
+    signature = np.full(len(a), EMPTY_SIGNATURE_VALUE, dtype=np.uint64)
+    for start in range(0, len(ngram_hashes), BLOCK_SIZE):
+        block = ngram_hashes[start:start + BLOCK_SIZE]
+        permuted = (a[:, None] * block[None, :] + b[:, None]) % MERSENNE_PRIME
+        np.minimum(signature, permuted.min(axis=1), out=signature)
+    return signature
+
+
+def minhash_signatures(documents_ngrams: list[list[str]], num_hashes: int, seed: int = 0) -> np.ndarray:
+    """Returns the (num documents, num_hashes) signature matrix of a list of n-gram lists"""
+    permutations = minhash_permutations(num_hashes, seed)
+    signatures = np.empty((len(documents_ngrams), num_hashes), dtype=np.uint64)
+    for i, ngrams in enumerate(documents_ngrams):
+        signatures[i] = minhash_signature(hash_ngrams(ngrams), permutations)
+    return signatures
+
+
+def nonempty_rows(signatures: np.ndarray) -> np.ndarray:
+    """Indices of the signature rows of documents with at least one n-gram.
+
+    Empty documents all share one signature but are never near duplicates, so LSH leaves
+    them out rather than verify every pair of them in every band.
+    """
+    if signatures.shape[1] == 0:
+        return np.arange(len(signatures))
+    return np.flatnonzero(signatures[:, 0] != EMPTY_SIGNATURE_VALUE)
+
+
+def signature_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """MinHash estimate of the Jaccard similarity of two signatures, 0 for empty documents"""
+    return np.count_nonzero((a == b) & (a != EMPTY_SIGNATURE_VALUE)) / len(a)
+
+
+# Multiplier of the polynomial rolling hash of character n-grams, odd so that it is invertible
+# modulo 2^64
+NGRAM_HASH_MULTIPLIER = np.uint64(0xBF58476D1CE4E5B9)
+
+
+def ngram_hash_array(text: str, ngram_length: int) -> np.ndarray:
+    """Returns the sorted distinct 64-bit hashes of the character n-grams of `text`.
+
+    The hashes are a polynomial over the code points of each n-gram, computed for all
+    positions at once with one vector operation per character of the n-gram. At 8 bytes per
+    distinct n-gram this is far smaller than a set of substrings, and collisions between the
+    n-grams of two documents are negligible for Jaccard similarity. A non-empty text shorter
+    than `ngram_length` is its own single n-gram, as in document_ngrams.
+    """
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codepoints) == 0:
+        return np.empty(0, dtype=np.uint64)
+    ngram_length = min(ngram_length, len(codepoints))
+    count = len(codepoints) - ngram_length + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for j in range(ngram_length):
+            hashes = hashes * NGRAM_HASH_MULTIPLIER + codepoints[j:j + count]
+    return np.unique(hashes)
+
+
+def sorted_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    """Jaccard similarity of two sorted arrays of distinct values; empty documents are not
+    near duplicates of anything, so two empty sets score 0"""
+    if len(a) == 0 and len(b) == 0:
+        return 0.0
+    intersection = len(np.intersect1d(a, b, assume_unique=True))
+    return intersection / (len(a) + len(b) - intersection)
+
+
+# Multiplier of the polynomial hash that folds a band of a signature into one key; uint64
+# arithmetic wraps around, which is what we want here
+BAND_KEY_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def band_keys(signatures: np.ndarray, num_bands: int) -> np.ndarray:
+    """Folds every band of each signature row into one uint64 key, giving (rows, num_bands) keys"""
+    rows_per_band = signatures.shape[1] // num_bands
+    bands = signatures[:, :rows_per_band * num_bands].reshape(len(signatures), num_bands, rows_per_band)
+    keys = np.zeros((len(signatures), num_bands), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for r in range(rows_per_band):
+            keys = keys * BAND_KEY_MULTIPLIER + bands[:, :, r]
+    return keys
+
+
+class SignatureStore:
+    """Append-only on-disk store of MinHash signatures and LSH band keys.
+
+    A store is a directory holding `meta.json` with the MinHash parameters, raw uint64
+    `signatures.bin` and `band_keys.bin` matrices that are memory-mapped on read, and
+    `paths.txt` with the absolute path of each row's document. Rows are appended to the
+    binary files before their paths, so rows without a path left by an interrupted append
+    are ignored.
+
+    Exact verification reads the stored documents back from their paths, so they must stay
+    in place. With `keep_ngrams` the store instead keeps the sorted n-gram hash array of
+    every row, concatenated in `ngrams.bin` with the end offset of each row in
+    `ngram_ends.bin`, so verification never reads the documents again. At 8 bytes per
+    distinct n-gram that is several times the size of the text itself.
+    """
+
+    def __init__(self, root: str | os.PathLike, num_hashes: int, num_bands: int, ngram_length: int, seed: int = 0, keep_ngrams: bool = False):
+        self.root = str(root)
+        self.meta = {"num_hashes": num_hashes, "num_bands": num_bands, "ngram_length": ngram_length, "seed": seed, "keep_ngrams": keep_ngrams}
+        os.makedirs(self.root, exist_ok=True)
+        meta_path = os.path.join(self.root, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                stored = json.load(f)
+            if stored != self.meta:
+                raise ValueError(f"Signature store {self.root} was built with {stored}, not {self.meta}")
+        else:
+            with open(meta_path, "w") as f:
+                json.dump(self.meta, f)
+        self.paths = []
+        paths_path = os.path.join(self.root, "paths.txt")
+        if os.path.exists(paths_path):
+            with open(paths_path) as f:
+                self.paths = [line.rstrip("\n") for line in f]
+        self.permutations = minhash_permutations(num_hashes, seed)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def _matrix(self, name: str, columns: int) -> np.ndarray:
+        path = os.path.join(self.root, name)
+        if not self.paths:
+            return np.empty((0, columns), dtype=np.uint64)
+        return np.memmap(path, dtype=np.uint64, mode="r", shape=(len(self.paths), columns))
+
+    @property
+    def signatures(self) -> np.ndarray:
+        return self._matrix("signatures.bin", self.meta["num_hashes"])
+
+    @property
+    def band_keys(self) -> np.ndarray:
+        return self._matrix("band_keys.bin", self.meta["num_bands"])
+
+    @property
+    def ngram_ends(self) -> np.ndarray:
+        return self._matrix("ngram_ends.bin", 1)[:, 0]
+
+    def ngram_array(self, row: int) -> np.ndarray:
+        """Returns the stored sorted n-gram hash array of `row`"""
+        ends = self.ngram_ends
+        start = int(ends[row - 1]) if row else 0
+        return np.fromfile(os.path.join(self.root, "ngrams.bin"), dtype=np.uint64, count=int(ends[row]) - start, offset=start * 8)
+
+    def add(self, paths: list[str], signatures: np.ndarray, keys: np.ndarray, ngram_arrays: list[np.ndarray] | None = None):
+        """Appends rows; `ngram_arrays` holds their n-gram hash arrays, needed with `keep_ngrams` only"""
+        files = [
+            ("signatures.bin", signatures, len(self.paths) * signatures.shape[1]),
+            ("band_keys.bin", keys, len(self.paths) * keys.shape[1]),
+        ]
+        if self.meta["keep_ngrams"]:
+            end = int(self.ngram_ends[-1]) if self.paths else 0
+            ends = end + np.cumsum([len(array) for array in ngram_arrays], dtype=np.uint64)
+            files.append(("ngram_ends.bin", ends, len(self.paths)))
+            files.append(("ngrams.bin", np.concatenate(ngram_arrays) if ngram_arrays else np.empty(0), end))
+        # Rows of an earlier interrupted append are dropped before writing
+        for name, data, size in files:
+            with open(os.path.join(self.root, name), "ab") as f:
+                f.truncate(size * 8)
+                f.write(np.ascontiguousarray(data, dtype=np.uint64).tobytes())
+        paths = [os.path.abspath(path) for path in paths]
+        with open(os.path.join(self.root, "paths.txt"), "a") as f:
+            f.writelines(f"{path}\n" for path in paths)
+        self.paths.extend(paths)
+
+    def candidates(self, keys: np.ndarray) -> list[set[int]]:
+        """Returns, for each row of query band keys, the stored rows sharing at least one band"""
+        stored = self.band_keys
+        matches = [set() for _ in range(len(keys))]
+        for band in range(keys.shape[1]):
+            column = np.asarray(stored[:, band])
+            hits = np.nonzero(np.isin(column, keys[:, band]))[0]
+            if len(hits) == 0:
+                continue
+            by_key = {}
+            for row in hits:
+                by_key.setdefault(column[row], []).append(int(row))
+            for i, key in enumerate(keys[:, band]):
+                matches[i].update(by_key.get(key, ()))
+        return matches
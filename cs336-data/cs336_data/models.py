@@ -0,0 +1,142 @@
+import os
+import platform
+import threading
+from collections import OrderedDict, namedtuple
+import fasttext
+import nltk
+
+
+model_path_prefix = "/home/shared/" if platform.system() != "Darwin" else "./models/"
+DEFAULT_MODEL_PATHS = {
+    "lang": model_path_prefix + "lid.176.bin",
+    "nsfw": model_path_prefix + "dolma-jigsaw-fasttext-bigrams-nsfw.bin",
+    "toxic": model_path_prefix + "dolma-jigsaw-fasttext-bigrams-hatespeech.bin",
+    "quality": "quality_model.ftz",
+}
+
+MODEL_CACHE_SIZE = 4
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+_models = {}
+_models_lock = threading.Lock()
+_punkt_ready = False
+
+
+class ModelCache:
+    """Bounded LRU cache of models loaded from user-supplied paths.
+
+    Entries are keyed by resolved path and modification time, so a model file that is
+    overwritten on disk is reloaded rather than served stale.
+    """
+
+    def __init__(self, maxsize: int = MODEL_CACHE_SIZE, loader=fasttext.load_model):
+        self.maxsize = maxsize
+        self.loader = loader
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str | os.PathLike):
+        resolved = os.path.realpath(path)
+        key = (resolved, os.stat(resolved).st_mtime_ns)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+            # Drop stale versions of the same file before loading the new one
+            for stale in [k for k in self._entries if k[0] == resolved]:
+                del self._entries[stale]
+            model = self.loader(resolved)
+            self._entries[key] = model
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return model
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+_model_cache = ModelCache()
+
+
+def _reset_lock_in_child():
+    # A fork taken while another thread holds a lock would deadlock the child
+    global _models_lock
+    _models_lock = threading.Lock()
+    _model_cache._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock_in_child)
+
+
+def get_model(name: str):
+    """Returns the default fastText model registered under `name`, loading it on first use"""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    if name not in DEFAULT_MODEL_PATHS:
+        raise KeyError(f"Unknown model {name!r}, expected one of {sorted(DEFAULT_MODEL_PATHS)}")
+    with _models_lock:
+        if name not in _models:
+            _models[name] = fasttext.load_model(DEFAULT_MODEL_PATHS[name])
+        return _models[name]
+
+
+def load_model(path: str | os.PathLike):
+    """Loads a fastText model from `path`, reusing the per-process LRU cache"""
+    return _model_cache.get(path)
+
+
+def model_cache_info() -> CacheInfo:
+    return _model_cache.info()
+
+
+def clear_model_cache():
+    _model_cache.clear()
+
+
+def _has_nltk_resource(name: str) -> bool:
+    try:
+        nltk.data.find(name)
+    except LookupError:
+        return False
+    return True
+
+
+def ensure_punkt():
+    """Makes sure the NLTK "punkt_tab" tokenizer data that word_tokenize loads is available,
+    downloading it only if it is missing. The older pickled "punkt" data is not enough.
+
+    Raises LookupError if the data cannot be found after the download.
+    """
+    global _punkt_ready
+    if _punkt_ready:
+        return
+    if not _has_nltk_resource("tokenizers/punkt_tab"):
+        nltk.download("punkt_tab", quiet=True)
+        if not _has_nltk_resource("tokenizers/punkt_tab"):
+            raise LookupError("NLTK Punkt tokenizer data is missing and could not be downloaded; install it with `python -m nltk.downloader punkt_tab`")
+    _punkt_ready = True
+
+
+def warm_models(names: list[str] | None = None, punkt: bool = True):
+    """Loads models up front, e.g. in a parent process before forking so workers share them copy-on-write"""
+    for name in names if names is not None else DEFAULT_MODEL_PATHS:
+        get_model(name)
+    if punkt:
+        ensure_punkt()
+
+
+def loaded_models() -> list[str]:
+    return sorted(_models)
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds in seconds of the per-document latency histogram buckets: 0.5ms, 1ms, ..., ~33s,
+# followed by an unbounded overflow bucket
+LATENCY_BUCKETS = [0.0005 * 2 ** i for i in range(17)]
+
+
+def _empty_stage() -> dict:
+    return {"calls": 0, "docs": 0, "rejected": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0}
+
+
+class PipelineStats:
+    """Wall and CPU time per stage, throughput, rejections, free-form counters and a per-document
+    latency histogram.
+
+    Stages are timed with the `stage` context manager. The summary is written as JSON to
+    `report_path` every `report_interval` seconds from `maybe_report` and once more from
+    `report` at the end of the run.
+    """
+
+    def __init__(self, report_path: str | None = None, report_interval: float = 60.0):
+        self.report_path = report_path
+        self.report_interval = report_interval
+        self.stages = {}
+        self.counters = {}
+        self.docs = 0
+        self.bytes = 0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.start_time = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self._last_report = self.start_time
+
+    def restore(self, summary: dict):
+        """Continues counting from the summary of an interrupted run"""
+        self.stages = {name: dict(stage) for name, stage in summary["stages"].items()}
+        self.counters = dict(summary["counters"])
+        self.docs = summary["docs"]
+        self.bytes = summary["bytes"]
+        self.latency_counts = list(summary["latency_histogram"]["counts"])
+        self.start_time -= summary["wall_seconds"]
+        self.start_cpu -= summary["cpu_seconds"]
+
+    @contextmanager
+    def stage(self, name: str, docs: int = 1):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu, docs)
+
+    def add(self, name: str, wall_seconds: float, cpu_seconds: float, docs: int = 1, rejected: int = 0):
+        stage = self.stages.setdefault(name, _empty_stage())
+        stage["calls"] += 1
+        stage["docs"] += docs
+        stage["rejected"] += rejected
+        stage["wall_seconds"] += wall_seconds
+        stage["cpu_seconds"] += cpu_seconds
+
+    def reject(self, name: str, count: int = 1):
+        self.stages.setdefault(name, _empty_stage())["rejected"] += count
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_document(self, latency: float, num_bytes: int):
+        self.docs += 1
+        self.bytes += num_bytes
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and latency > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        self.latency_counts[bucket] += 1
+
+    def summary(self) -> dict:
+        wall = time.perf_counter() - self.start_time
+        return {
+            "docs": self.docs,
+            "bytes": self.bytes,
+            "wall_seconds": wall,
+            "cpu_seconds": time.process_time() - self.start_cpu,
+            "docs_per_second": self.docs / wall if wall > 0 else 0.0,
+            "bytes_per_second": self.bytes / wall if wall > 0 else 0.0,
+            "stages": self.stages,
+            "counters": self.counters,
+            "latency_histogram": {
+                "bucket_upper_bounds": LATENCY_BUCKETS + [None],
+                "counts": self.latency_counts,
+            },
+        }
+
+    def report(self):
+        self._last_report = time.perf_counter()
+        if self.report_path is not None:
+            write_stats(self.summary(), self.report_path)
+
+    def maybe_report(self):
+        if time.perf_counter() - self._last_report >= self.report_interval:
+            self.report()
+
+
+def write_stats(summary: dict, path: str):
+    # Replaced atomically, since a parent process may read the file while a worker reports
+    with open(path + ".tmp", "w") as f:
+        json.dump(summary, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def merge_summaries(summaries: list[dict], wall_seconds: float | None = None) -> dict:
+    """Combines the summaries of concurrently running workers into one.
+
+    Workers overlap in time, so the caller should pass the wall time of the whole run;
+    otherwise the slowest summary's is used.
+    """
+    stages = {}
+    for summary in summaries:
+        for name, stats in summary["stages"].items():
+            merged = stages.setdefault(name, _empty_stage())
+            for key in merged:
+                merged[key] += stats[key]
+    counters = {}
+    for summary in summaries:
+        for name, value in summary["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+    docs = sum(s["docs"] for s in summaries)
+    num_bytes = sum(s["bytes"] for s in summaries)
+    wall = wall_seconds if wall_seconds is not None else max((s["wall_seconds"] for s in summaries), default=0.0)
+    return {
+        "docs": docs,
+        "bytes": num_bytes,
+        "wall_seconds": wall,
+        "cpu_seconds": sum(s["cpu_seconds"] for s in summaries),
+        "docs_per_second": docs / wall if wall > 0 else 0.0,
+        "bytes_per_second": num_bytes / wall if wall > 0 else 0.0,
+        "stages": stages,
+        "counters": counters,
+        "latency_histogram": {
+            "bucket_upper_bounds": LATENCY_BUCKETS + [None],
+            "counts": [sum(c) for c in zip(*(s["latency_histogram"]["counts"] for s in summaries))] if summaries else [],
+        },
+    }
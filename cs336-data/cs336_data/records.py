@@ -0,0 +1,185 @@
+import os
+import gzip
+import functools
+import json
+import tempfile
+import numpy as np
+from fastwarc import ArchiveIterator
+from fastwarc.warc import WarcRecordType
+
+from cs336_data.dedup import CHUNK_LINES, HASH_DTYPES, UnionFind, cluster_representatives, duplicate_flags, find_duplicate_hashes, lsh_candidate_pairs, verify_pairs
+from cs336_data.minhash import hash_ngrams, minhash_permutations, minhash_signature, ngram_hash_array
+from cs336_data.utils import document_ngrams, extract_text, record_content_type, normalize_text
+
+
+def is_warc(path: os.PathLike) -> bool:
+    return ".warc" in os.path.basename(path)
+
+
+def open_shard(path: os.PathLike, mode: str = "rb"):
+    return gzip.open(path, mode) if str(path).endswith(".gz") else open(path, mode)
+
+
+def iter_records(path: os.PathLike, text_field: str = "text"):
+    """Yields (offset, text) for every record of a JSONL or WARC shard.
+
+    JSONL offsets are byte offsets of the line in the decompressed shard. WARC offsets are
+    record positions in the raw file, i.e. of the gzip member for compressed WARCs. The
+    text is None for WARC records that are not responses; they are passed through as is.
+    """
+    if is_warc(path):
+        with open(path, "rb") as stream:
+            for record in ArchiveIterator(stream):
+                if record.record_type != WarcRecordType.response:
+                    yield record.stream_pos, None
+                    continue
+                yield record.stream_pos, extract_text(record.reader.read(), record_content_type(record))
+        return
+    with open_shard(path) as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                yield offset, json.loads(line)[text_field]
+            offset += len(line)
+
+
+def write_filtered_shard(path: os.PathLike, output_path: os.PathLike, removed: set[int]):
+    """Copies the records of a shard whose offset is not in `removed` to `output_path` byte for byte"""
+    if is_warc(path):
+        with open(path, "rb") as stream:
+            offsets = [record.stream_pos for record in ArchiveIterator(stream, parse_http=False)]
+        ends = offsets[1:] + [os.path.getsize(path)]
+        with open(path, "rb") as f, open(output_path, "wb") as out:
+            for start, end in zip(offsets, ends):
+                if start in removed:
+                    continue
+                f.seek(start)
+                out.write(f.read(end - start))
+        return
+    with open_shard(path) as f, open_shard(output_path, "wb") as out:
+        offset = 0
+        for line in f:
+            if offset not in removed:
+                out.write(line)
+            offset += len(line)
+
+
+def _filter_record_lines(records: list[tuple[dict, list[str]]], duplicates: list[np.ndarray], hash_bits: int, text_field: str, out):
+    lines = [line for _, record_lines in records for line in record_lines]
+    is_duplicate = iter(duplicate_flags(lines, duplicates, hash_bits))
+    for record, record_lines in records:
+        text = "".join(line for line in record_lines if not next(is_duplicate))
+        if text:
+            record[text_field] = text
+            out.write((json.dumps(record) + "\n").encode())
+
+
+def deduplicate_lines_records(
+    shard_paths: list[os.PathLike],
+    output_dir: os.PathLike,
+    num_partitions: int = 16,
+    hash_bits: int = 64,
+    text_field: str = "text",
+    work_dir: os.PathLike | None = None,
+):
+    """Exact line deduplication over the records of JSONL shards, as deduplicate_lines_partitioned.
+
+    Lines are counted across the `text_field` of every record of every shard. Each shard is
+    then rewritten to `output_dir` under its own name with the duplicated lines removed from
+    every record; records left without text are dropped.
+    """
+    if hash_bits not in HASH_DTYPES:
+        raise ValueError(f"hash_bits must be one of {sorted(HASH_DTYPES)}, got {hash_bits}")
+    for path in shard_paths:
+        if is_warc(path):
+            raise ValueError(f"Line deduplication rewrites record text and only supports JSONL shards, got {path}")
+
+    def line_chunks():
+        chunk = []
+        for path in shard_paths:
+            for _, text in iter_records(path, text_field):
+                chunk.extend(text.splitlines(keepends=True))
+                if len(chunk) >= CHUNK_LINES:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        duplicates = find_duplicate_hashes(line_chunks(), num_partitions, hash_bits, tmp)
+        for path in shard_paths:
+            with open_shard(path) as f, open_shard(os.path.join(output_dir, os.path.basename(path)), "wb") as out:
+                batch, num_lines = [], 0
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    lines = record[text_field].splitlines(keepends=True)
+                    batch.append((record, lines))
+                    num_lines += len(lines)
+                    if num_lines >= CHUNK_LINES:
+                        _filter_record_lines(batch, duplicates, hash_bits, text_field, out)
+                        batch, num_lines = [], 0
+                _filter_record_lines(batch, duplicates, hash_bits, text_field, out)
+
+
+def deduplicate_fuzzy_records(
+    shard_paths: list[os.PathLike],
+    output_dir: os.PathLike,
+    num_hashes: int,
+    num_bands: int,
+    ngram_length: int,
+    threshold: float,
+    seed: int = 0,
+    estimate_jaccard: bool = False,
+    text_field: str = "text",
+    cache_size: int = 1024,
+    work_dir: os.PathLike | None = None,
+) -> dict[str, int]:
+    """MinHash LSH near-duplicate removal over the records of JSONL or WARC shards.
+
+    Documents are keyed by (shard, offset) and only their signatures are kept in memory.
+    For exact verification the normalized text of every record is spilled to a temporary
+    file in `work_dir` while the shards are signed, so the shards are read once; the n-gram
+    hash arrays are then rebuilt from the spill through an LRU cache of `cache_size`
+    records. Every shard is written to `output_dir` under its own name without the removed
+    records, which are otherwise copied byte for byte; WARC records other than responses
+    are always kept. Returns the number of removed records per shard path.
+    """
+    rows_per_band = num_hashes // num_bands
+    permutations = minhash_permutations(num_hashes, seed)
+    keys, signatures, spans = [], [], []
+    with tempfile.TemporaryFile(dir=work_dir) as spill:
+        for shard, path in enumerate(shard_paths):
+            for offset, text in iter_records(path, text_field):
+                if text is None:
+                    continue
+                text = normalize_text(text)
+                keys.append((shard, offset))
+                signatures.append(minhash_signature(hash_ngrams(document_ngrams(text, ngram_length)), permutations))
+                if not estimate_jaccard:
+                    start = spill.tell()
+                    spill.write(text.encode("utf-8", "surrogatepass"))
+                    spans.append((start, spill.tell()))
+        signatures = np.stack(signatures) if signatures else np.empty((0, num_hashes), dtype=np.uint64)
+
+        @functools.lru_cache(maxsize=cache_size)
+        def ngram_array(span: tuple[int, int]) -> np.ndarray:
+            start, end = span
+            spill.seek(start)
+            return ngram_hash_array(spill.read(end - start).decode("utf-8", "surrogatepass"), ngram_length)
+
+        union_find = UnionFind(len(keys))
+        candidates = lsh_candidate_pairs(signatures[:, :num_bands * rows_per_band], rows_per_band, union_find)
+        verify_pairs(candidates, spans, signatures, ngram_length, threshold, estimate_jaccard, union_find=union_find, ngram_array=ngram_array)
+
+    representatives = cluster_representatives(union_find, seed)
+    removed = [set() for _ in shard_paths]
+    for cluster in union_find.clusters():
+        for i in cluster:
+            if i not in representatives:
+                shard, offset = keys[i]
+                removed[shard].add(offset)
+    for shard, path in enumerate(shard_paths):
+        write_filtered_shard(path, os.path.join(output_dir, os.path.basename(path)), removed[shard])
+    return {str(path): len(removed[shard]) for shard, path in enumerate(shard_paths)}
@@ -1,45 +1,404 @@
-from fastwarc import ArchiveIterator
+import os
+import glob
+import json
+import time
 import argparse
+from typing import NamedTuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from fastwarc import ArchiveIterator
 from tqdm import tqdm
-from cs336_data.utils import extract_text, identify_language, mask_emails, mask_phone_numbers, mask_ipv4, classify_nsfw, classify_toxic_speech, gopher_filters
+from cs336_data.models import warm_models
+from cs336_data.filters import HTML_CONTENT_TYPES, RecordFilter, build_filter_chain, filter_batch, load_blocklist, merge_profiles
+from cs336_data.profiling import PipelineStats, merge_summaries, write_stats
+from cs336_data.writers import DEFAULT_SHARD_BYTES, OUTPUT_FORMATS, make_writer
+from cs336_data.utils import GOPHER_TOKENIZERS, extract_text, record_content_type
 
 
-def main(
+DEFAULT_BATCH_SIZE = 64
+# Payloads are read in chunks of this size when a record deadline is set
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class RecordLimits(NamedTuple):
+    """Per-record caps bounding worst-case latency; None disables a cap.
+
+    Payloads are read up to `max_payload_bytes` and extracted text is cut to
+    `max_text_chars`, so oversized records are truncated rather than dropped. A record is
+    skipped as slow once reading its payload passes `slow_record_seconds`, without extracting
+    it, or when read and extraction together took longer. Extraction itself cannot be
+    interrupted; the payload cap is what bounds it.
+    """
+    max_payload_bytes: int | None = None
+    max_text_chars: int | None = None
+    slow_record_seconds: float | None = None
+
+
+def read_payload(reader, max_bytes: int | None = None, deadline: float | None = None) -> bytes | None:
+    """Reads up to `max_bytes` of a record payload, or all of it, and None once past the
+    `time.perf_counter` `deadline`, checked between chunks of READ_CHUNK_BYTES"""
+    if deadline is None:
+        return reader.read() if max_bytes is None else reader.read(max_bytes)
+    chunks, size = [], 0
+    while max_bytes is None or size < max_bytes:
+        chunk = reader.read(READ_CHUNK_BYTES if max_bytes is None else min(READ_CHUNK_BYTES, max_bytes - size))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if time.perf_counter() > deadline:
+            return None
+    return b"".join(chunks)
+
+
+def process_shard(
         identify: bool,
         mask_pii: bool,
         classify: bool,
         gopher: bool,
         input_path: str,
-        output_path: str
-):
-    with open(output_path, 'w') as f:
-        for record in tqdm(ArchiveIterator(open(input_path, 'rb')), desc="Processing records"):
-            output = str(record.http_headers)
-            content = record.reader.read()
-            content = extract_text(content)
-            if identify:
-                lang, conf = identify_language(content)
-                if lang != '__label__en' or conf < 0.65:
-                    continue
-            if classify:
-                nsf, conf = classify_nsfw(content)
-                if nsf != '__label__non-nsfw' or conf < 0.9:
-                    continue
-                toxic, conf = classify_toxic_speech(content)
-                if toxic != '__label__non-toxic' or conf < 0.9:
-                    continue
-            if gopher:
-                filter_gopher = gopher_filters(content)
-                if not filter_gopher:
+        output_path: str,
+        progress: bool = True,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        profile: dict | None = None,
+        adaptive: bool = True,
+        stats_path: str | None = None,
+        stats_interval: float = 60.0,
+        gopher_tokenizer: str = "nltk",
+        record_filter: RecordFilter | None = None,
+        limits: RecordLimits = RecordLimits(),
+        output_format: str = "text",
+        shard_bytes: int = DEFAULT_SHARD_BYTES,
+        checkpoint_interval: float | None = None
+) -> dict:
+    """Filters one WARC file and returns per-shard counts for the manifest.
+
+    The "text" `output_format` writes one file at `output_path`; the structured formats
+    write records with their URL, classifier scores, PII counts and text to shards of
+    `shard_bytes` named after `output_path`, listed under "output_paths".
+
+    With a `record_filter`, records are first checked on their headers and rejected ones are
+    skipped without reading their payload; they are counted in `num_records` and
+    `num_prefiltered`. Truncated and slow records are counted in the stats under "limits:*".
+
+    With a `checkpoint_interval`, the offset of the next unprocessed record, the output
+    writer state, the filter profile and the stats are saved to `checkpoint_path(output_path)`
+    at the first batch boundary after every `checkpoint_interval` seconds at which the writer
+    can checkpoint; for parquet that is only between a shard rollover and the next bulk
+    write. A rerun resumes from the checkpoint, cutting the output back to it so that every
+    record is written exactly once, and returns the stored result of a shard that already
+    completed. The arguments that shape the output are stored with the checkpoint, and a
+    rerun with different ones raises a ValueError.
+    """
+    num_records, num_kept, num_prefiltered = 0, 0, 0
+    # Round-tripped through JSON so that it compares equal to the stored copy
+    config = json.loads(json.dumps({
+        "input_path": input_path,
+        "identify": identify,
+        "mask_pii": mask_pii,
+        "classify": classify,
+        "gopher": gopher,
+        "gopher_tokenizer": gopher_tokenizer,
+        "record_filter": {**vars(record_filter), "blocked_domains": sorted(record_filter.blocked_domains)} if record_filter is not None else None,
+        "limits": limits._asdict(),
+        "output_format": output_format,
+        "shard_bytes": shard_bytes,
+    }))
+    checkpoint_file = checkpoint_path(output_path)
+    checkpoint = load_checkpoint(checkpoint_file) if checkpoint_interval is not None else None
+    if checkpoint is not None and checkpoint["config"] != config:
+        changed = [key for key in config if checkpoint["config"].get(key) != config[key]]
+        raise ValueError(f"Checkpoint {checkpoint_file} was written with different {', '.join(changed)}; rerun with the same arguments or delete it")
+    if checkpoint is not None and checkpoint["complete"]:
+        return checkpoint["result"]
+    stats = PipelineStats(stats_path, stats_interval)
+    if checkpoint is not None:
+        num_records, num_kept, num_prefiltered = checkpoint["num_records"], checkpoint["num_kept"], checkpoint["num_prefiltered"]
+        profile = checkpoint["filter_profile"]
+        stats.restore(checkpoint["stats"])
+    chain = build_filter_chain(identify, classify, gopher, profile, adaptive, stats, gopher_tokenizer)
+
+    def save(next_offset: int | None, result: dict | None = None):
+        save_checkpoint({
+            "config": config,
+            "complete": result is not None,
+            "result": result,
+            "next_offset": next_offset,
+            "num_records": num_records,
+            "num_kept": num_kept,
+            "num_prefiltered": num_prefiltered,
+            "writer": writer.checkpoint() if result is None else None,
+            "filter_profile": chain.profile(),
+            "stats": stats.summary(),
+        }, checkpoint_file)
+
+    def flush(metadata: list[dict], contents: list[str], latencies: list[float], sizes: list[int]) -> int:
+        if not contents:
+            return 0
+        start = time.perf_counter()
+        kept = 0
+        outputs = filter_batch(contents, chain, mask_pii, stats, metadata)
+        with stats.stage("write", len(contents)):
+            for record, content in zip(metadata, outputs):
+                if content is None:
                     continue
-            if mask_pii:
-                content, count1 = mask_emails(content)
-                content, count2 = mask_phone_numbers(content)
-                content, count3 = mask_ipv4(content)
-                if count1 + count2 + count3 == 0:
+                record["text"] = content
+                writer.write(record)
+                kept += 1
+        # Batched stages are charged to every document of the batch in equal parts
+        batch_latency = (time.perf_counter() - start) / len(contents)
+        for latency, size in zip(latencies, sizes):
+            stats.record_document(latency + batch_latency, size)
+        stats.maybe_report()
+        return kept
+
+    writer_state = checkpoint["writer"] if checkpoint is not None else None
+    with open(input_path, 'rb') as stream, make_writer(output_format, output_path, shard_bytes, state=writer_state) as writer:
+        if checkpoint is not None:
+            stream.seek(checkpoint["next_offset"])
+        last_checkpoint = time.perf_counter()
+        records = ArchiveIterator(stream)
+        if progress:
+            records = tqdm(records, desc="Processing records")
+        metadata, contents, latencies, sizes = [], [], [], []
+        for record in records:
+            if len(contents) >= batch_size:
+                num_kept += flush(metadata, contents, latencies, sizes)
+                metadata, contents, latencies, sizes = [], [], [], []
+            # Only between batches is everything before this record written out
+            if checkpoint_interval is not None and not contents and writer.can_checkpoint and time.perf_counter() - last_checkpoint >= checkpoint_interval:
+                save(record.stream_pos)
+                last_checkpoint = time.perf_counter()
+            start = time.perf_counter()
+            num_records += 1
+            if record_filter is not None:
+                with stats.stage("prefilter"):
+                    reason = record_filter.reject_reason(record)
+                if reason is not None:
+                    num_prefiltered += 1
+                    stats.reject("prefilter")
+                    stats.count(f"prefilter:{reason}")
                     continue
-            output += content
-            f.write(output + "\n\n")
+            deadline = start + limits.slow_record_seconds if limits.slow_record_seconds is not None else None
+            with stats.stage("read"):
+                # One byte past the cap tells a truncated payload from one exactly at it
+                payload = read_payload(record.reader, limits.max_payload_bytes + 1 if limits.max_payload_bytes is not None else None, deadline)
+            if payload is None:
+                stats.reject("slow_record")
+                stats.count("limits:slow_record")
+                stats.record_document(time.perf_counter() - start, record.content_length)
+                continue
+            if limits.max_payload_bytes is not None and len(payload) > limits.max_payload_bytes:
+                payload = payload[:limits.max_payload_bytes]
+                stats.count("limits:payload_truncated")
+            with stats.stage("extract_text"):
+                content = extract_text(payload, record_content_type(record))
+            if limits.max_text_chars is not None and len(content) > limits.max_text_chars:
+                content = content[:limits.max_text_chars]
+                stats.count("limits:text_truncated")
+            latency = time.perf_counter() - start
+            if deadline is not None and start + latency > deadline:
+                stats.reject("slow_record")
+                stats.count("limits:slow_record")
+                stats.record_document(latency, len(payload))
+                continue
+            metadata.append({
+                "url": record.headers.get("WARC-Target-URI"),
+                "record_id": record.record_id,
+                "http_headers": str(record.http_headers),
+            })
+            contents.append(content)
+            latencies.append(latency)
+            sizes.append(len(payload))
+        num_kept += flush(metadata, contents, latencies, sizes)
+    stats.report()
+    result = {"input_path": input_path, "output_path": output_path, "output_paths": writer.paths, "num_records": num_records, "num_kept": num_kept, "num_prefiltered": num_prefiltered, "filter_profile": chain.profile(), "stats": stats.summary()}
+    if checkpoint_interval is not None:
+        save(None, result)
+    return result
+
+
+def main(
+        identify: bool,
+        mask_pii: bool,
+        classify: bool,
+        gopher: bool,
+        input_path: str,
+        output_path: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        profile_path: str | None = None,
+        adaptive: bool = True,
+        stats_path: str | None = None,
+        stats_interval: float = 60.0,
+        gopher_tokenizer: str = "nltk",
+        record_filter: RecordFilter | None = None,
+        limits: RecordLimits = RecordLimits(),
+        output_format: str = "text",
+        shard_bytes: int = DEFAULT_SHARD_BYTES,
+        checkpoint_interval: float | None = None
+):
+    shard = process_shard(
+        identify, mask_pii, classify, gopher, input_path, output_path,
+        batch_size=batch_size, profile=load_profile(profile_path), adaptive=adaptive,
+        stats_path=stats_path, stats_interval=stats_interval, gopher_tokenizer=gopher_tokenizer,
+        record_filter=record_filter, limits=limits, output_format=output_format,
+        shard_bytes=shard_bytes, checkpoint_interval=checkpoint_interval,
+    )
+    if profile_path is not None:
+        save_profile(shard["filter_profile"], profile_path)
+
+
+def checkpoint_path(output_path: str) -> str:
+    return output_path + ".checkpoint.json"
+
+
+def load_checkpoint(path: str) -> dict | None:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint: dict, path: str):
+    # Written to a temporary file first, so a crash leaves either the old or the new checkpoint
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_profile(profile_path: str | None) -> dict | None:
+    if profile_path is None or not os.path.exists(profile_path):
+        return None
+    with open(profile_path) as f:
+        return json.load(f)
+
+
+def save_profile(profile: dict, profile_path: str):
+    with open(profile_path, "w") as f:
+        json.dump(profile, f, indent=2)
+
+
+def resolve_input_paths(input_path: str) -> list[str]:
+    """Expands a WARC file, a directory of WARC files or a glob pattern into a sorted list of paths"""
+    if os.path.isdir(input_path):
+        return sorted(glob.glob(os.path.join(input_path, "*.warc*")))
+    return sorted(glob.glob(input_path))
+
+
+def shard_output_path(input_path: str, output_dir: str, output_format: str = "text") -> str:
+    """Output file of a shard in text format, otherwise the prefix of its output shards"""
+    suffix = ".out.txt" if output_format == "text" else ".out"
+    return os.path.join(output_dir, os.path.basename(input_path) + suffix)
+
+
+def main_parallel(
+        identify: bool,
+        mask_pii: bool,
+        classify: bool,
+        gopher: bool,
+        input_path: str,
+        output_dir: str,
+        num_workers: int = os.cpu_count(),
+        max_in_flight: int | None = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        profile_path: str | None = None,
+        adaptive: bool = True,
+        stats_interval: float = 60.0,
+        gopher_tokenizer: str = "nltk",
+        record_filter: RecordFilter | None = None,
+        limits: RecordLimits = RecordLimits(),
+        output_format: str = "text",
+        shard_bytes: int = DEFAULT_SHARD_BYTES,
+        checkpoint_interval: float | None = None
+) -> dict:
+    """Filters every WARC matched by `input_path` on a process pool, one shard per task.
+
+    Each worker streams its shard in batches of `batch_size` records, so at most
+    `num_workers * batch_size` documents are in flight at once; `max_in_flight` bounds how
+    many shards are queued on the pool (defaults to twice the number of workers). Writes the
+    output of every shard (see process_shard) and a `manifest.json` merging the per-shard
+    counts into `output_dir`. The filter profile at
+    `profile_path`, if any, seeds every worker's stage order and is updated with the stage
+    statistics merged across shards. Every shard periodically writes its pipeline stats
+    next to its output. Every `stats_interval` seconds the stats of the completed shards and
+    the latest stats of the running ones are merged into `stats.json` in `output_dir`, and
+    the manifest holds the stats merged over the whole run. With a
+    `checkpoint_interval`, every shard checkpoints next to its output, so rerunning an
+    interrupted job skips the completed shards and resumes the others.
+    """
+    input_paths = resolve_input_paths(input_path)
+    if not input_paths:
+        raise FileNotFoundError(f"No WARC files found for {input_path}")
+    os.makedirs(output_dir, exist_ok=True)
+    # Load models before the pool forks so that workers share them copy-on-write
+    warm_models((["lang"] if identify else []) + (["nsfw", "toxic"] if classify else []), punkt=gopher and gopher_tokenizer == "nltk")
+    if max_in_flight is None:
+        max_in_flight = 2 * num_workers
+    profile = load_profile(profile_path)
+
+    start = time.perf_counter()
+    shards = []
+    pending = set()
+    stats_paths = {}
+    remaining = iter(input_paths)
+
+    def write_live_stats():
+        summaries = [s["stats"] for s in shards]
+        for future in pending:
+            # Shards that have not reported yet have nothing to add
+            try:
+                with open(stats_paths[future]) as f:
+                    summaries.append(json.load(f))
+            except FileNotFoundError:
+                pass
+        write_stats(merge_summaries(summaries, time.perf_counter() - start), os.path.join(output_dir, "stats.json"))
+
+    last_report = start
+    with ProcessPoolExecutor(max_workers=num_workers) as executor, tqdm(total=len(input_paths), desc="Processing shards") as pbar:
+        while True:
+            for path in remaining:
+                output_path = shard_output_path(path, output_dir, output_format)
+                future = executor.submit(
+                    process_shard, identify, mask_pii, classify, gopher, path, output_path,
+                    progress=False, batch_size=batch_size, profile=profile, adaptive=adaptive,
+                    stats_path=output_path + ".stats.json", stats_interval=stats_interval,
+                    gopher_tokenizer=gopher_tokenizer, record_filter=record_filter, limits=limits,
+                    output_format=output_format, shard_bytes=shard_bytes, checkpoint_interval=checkpoint_interval,
+                )
+                pending.add(future)
+                stats_paths[future] = output_path + ".stats.json"
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, timeout=stats_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                shards.append(future.result())
+                del stats_paths[future]
+                pbar.update(1)
+            if time.perf_counter() - last_report >= stats_interval:
+                write_live_stats()
+                last_report = time.perf_counter()
+
+    shards.sort(key=lambda s: s["input_path"])
+    filter_profile = merge_profiles([s.pop("filter_profile") for s in shards], base=profile)
+    if profile_path is not None:
+        save_profile(filter_profile, profile_path)
+    stats = merge_summaries([s.pop("stats") for s in shards], time.perf_counter() - start)
+    write_stats(stats, os.path.join(output_dir, "stats.json"))
+    manifest = {
+        "num_shards": len(shards),
+        "num_records": sum(s["num_records"] for s in shards),
+        "num_kept": sum(s["num_kept"] for s in shards),
+        "num_prefiltered": sum(s["num_prefiltered"] for s in shards),
+        "filter_profile": filter_profile,
+        "stats": stats,
+        "shards": shards,
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
 
 
 if __name__ == '__main__':
@@ -48,8 +407,47 @@ if __name__ == '__main__':
     parser.add_argument('--mask', action='store_true')
     parser.add_argument('--classify', action='store_true')
     parser.add_argument('--gopher', action='store_true')
+    parser.add_argument('--parallel', action='store_true', help="treat input_path as a directory or glob of WARCs and output_path as an output directory")
+    parser.add_argument('--num-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-in-flight', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--filter-profile', default=None, help="JSON filter profile to seed the stage order from and update at the end")
+    parser.add_argument('--static-order', action='store_true', help="do not reorder filter stages at runtime")
+    parser.add_argument('--stats-path', default=None, help="where to write the JSON pipeline stats in single-file mode")
+    parser.add_argument('--stats-interval', type=float, default=60.0, help="seconds between intermediate stats reports")
+    parser.add_argument('--gopher-tokenizer', choices=["nltk", *GOPHER_TOKENIZERS], default="nltk")
+    parser.add_argument('--prefilter', action='store_true', help="reject records on their headers before reading them: non-responses, non-200 statuses, other content types, and --max-content-length/--blocklist")
+    parser.add_argument('--content-types', nargs='+', default=list(HTML_CONTENT_TYPES), help="HTTP content types to keep with --prefilter")
+    parser.add_argument('--max-content-length', type=int, default=None, help="with --prefilter, reject records with a larger WARC Content-Length")
+    parser.add_argument('--blocklist', default=None, help="with --prefilter, a file of domains to reject, one per line")
+    parser.add_argument('--max-payload-bytes', type=int, default=None, help="read at most this many payload bytes per record")
+    parser.add_argument('--max-text-chars', type=int, default=None, help="truncate extracted text to this many characters")
+    parser.add_argument('--slow-record-seconds', type=float, default=None, help="skip records still being read after this many seconds, or whose read and extraction took longer; extraction is not interrupted, bound it with --max-payload-bytes")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default="text", help="structured formats are written as shards prefixed by the output path")
+    parser.add_argument('--shard-bytes', type=int, default=DEFAULT_SHARD_BYTES, help="uncompressed size at which structured output rolls over to a new shard")
+    parser.add_argument('--checkpoint-interval', type=float, default=None, help="seconds between checkpoints; a rerun with the same arguments resumes from the last one. Parquet shards cannot be appended to, so parquet output is only checkpointed when a shard rolls over")
     parser.add_argument('input_path')
     parser.add_argument('output_path')
     args = parser.parse_args()
 
-    main(args.identify, args.mask, args.classify, args.gopher, args.input_path, args.output_path)
\ No newline at end of file
+    record_filter = None
+    if args.prefilter:
+        blocked_domains = load_blocklist(args.blocklist) if args.blocklist else set()
+        record_filter = RecordFilter(content_types=tuple(args.content_types), max_content_length=args.max_content_length, blocked_domains=blocked_domains)
+    limits = RecordLimits(args.max_payload_bytes, args.max_text_chars, args.slow_record_seconds)
+    options = dict(
+        batch_size=args.batch_size,
+        profile_path=args.filter_profile,
+        adaptive=not args.static_order,
+        stats_interval=args.stats_interval,
+        gopher_tokenizer=args.gopher_tokenizer,
+        record_filter=record_filter,
+        limits=limits,
+        output_format=args.output_format,
+        shard_bytes=args.shard_bytes,
+        checkpoint_interval=args.checkpoint_interval,
+    )
+    if args.parallel:
+        main_parallel(args.identify, args.mask, args.classify, args.gopher, args.input_path, args.output_path, num_workers=args.num_workers, max_in_flight=args.max_in_flight, **options)
+    else:
+        main(args.identify, args.mask, args.classify, args.gopher, args.input_path, args.output_path, stats_path=args.stats_path, **options)
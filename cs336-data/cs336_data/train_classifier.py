@@ -3,6 +3,7 @@ import json
 import gzip
 import random
 import asyncio
+import functools
 import multiprocessing
 from concurrent.futures import ProcessPoolExecutor
 random.seed(42)
@@ -10,12 +11,14 @@ random.seed(42)
 from tqdm import tqdm
 from fastwarc import ArchiveIterator
 
-from cs336_data.utils import extract_text, identify_language, classify_nsfw, classify_toxic_speech, gopher_filters
+from cs336_data.filters import build_filter_chain, filter_batch
+from cs336_data.utils import extract_text, record_content_type
 
 
 NUM_SAMPLES = 64000
 URL_PATH = "/home/shared/enwiki-20240420-extracted_urls.txt.gz"
 OUTPUT_PATH = "./data"
+BATCH_SIZE = 64
 
 
 def sample_urls_sharded(num_samples: int, num_shards: int = 16) -> list[str]:
@@ -45,43 +48,45 @@ async def download_all_shards(num_shards: int = 16) -> None:
     await asyncio.gather(*tasks)
 
 
+@functools.lru_cache(maxsize=None)
+def filter_chain():
+    """The quality filter chain, built on first use in each process rather than at import"""
+    return build_filter_chain(identify=True, classify=True, gopher=True)
+
+
+def filter_contents(contents: list[str]) -> list[bool]:
+    """Batched filter_content, returns one keep flag per document in input order"""
+    return [c is not None for c in filter_batch(contents, filter_chain(), mask_pii=False)]
+
+
 def filter_content(content: str) -> bool:
-    lang, conf = identify_language(content)
-    if lang != '__label__en' or conf < 0.65:
-        return False
-    nsf, conf = classify_nsfw(content)
-    if nsf != '__label__non-nsfw' or conf < 0.9:
-        return False
-    toxic, conf = classify_toxic_speech(content)
-    if toxic != '__label__non-toxic' or conf < 0.9:
-        return False
-    filter_gopher = gopher_filters(content)
-    if not filter_gopher:
-        return False
-    return True
-
-
-def filter_documents(warc_file_path: str) -> list[str]:
-    documents = []
-    for record in tqdm(ArchiveIterator(open(warc_file_path, 'rb')), desc="Processing records"):
-        content = record.reader.read()
-        content = extract_text(content)
-        if not filter_content(content):
-            continue
-        documents.append(content)
-    return documents
+    return filter_contents([content])[0]
+
+
+def filter_batched(contents, batch_size: int = BATCH_SIZE):
+    """Yields the documents of `contents` that pass filter_content, classifying `batch_size` at a time"""
+    batch = []
+    for content in contents:
+        batch.append(content)
+        if len(batch) >= batch_size:
+            yield from (c for c, keep in zip(batch, filter_contents(batch)) if keep)
+            batch = []
+    yield from (c for c, keep in zip(batch, filter_contents(batch)) if keep)
 
 
-def filter_paloma_documents(paloma_path: str = "/home/shared/paloma_c4_100_domains_val/") -> list[str]:
+def filter_documents(warc_file_path: str, batch_size: int = BATCH_SIZE) -> list[str]:
+    with open(warc_file_path, 'rb') as stream:
+        contents = (extract_text(record.reader.read(), record_content_type(record)) for record in tqdm(ArchiveIterator(stream), desc="Processing records"))
+        return list(filter_batched(contents, batch_size))
+
+
+def filter_paloma_documents(paloma_path: str = "/home/shared/paloma_c4_100_domains_val/", batch_size: int = BATCH_SIZE) -> list[str]:
     documents = []
     for file in os.listdir(paloma_path):
         if not file.endswith(".jsonl.gz"):
             continue
-        for line in tqdm(gzip.open(f"{paloma_path}/{file}", "rb")):
-            content = json.loads(line.decode())["text"].replace("\n", " ")
-            if not filter_content(content):
-                continue
-            documents.append(content)
+        contents = (json.loads(line.decode())["text"].replace("\n", " ") for line in tqdm(gzip.open(f"{paloma_path}/{file}", "rb")))
+        documents.extend(filter_batched(contents, batch_size))
     return documents
 
 
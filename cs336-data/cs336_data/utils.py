@@ -1,89 +1,245 @@
-import re
 import os
 import re
 import nltk
+import codecs
+import itertools
 import mmh3
-import random
-import platform
-import fasttext
 import unicodedata
 from resiliparse import parse
 from resiliparse.extract import html2text
-
-nltk.download('punkt')
+from resiliparse.parse.html import HTMLTree
+
+from cs336_data.models import DEFAULT_MODEL_PATHS, get_model, load_model, ensure_punkt
+
+
+# Encoding detection only looks at this many bytes of a payload, half from each end
+DETECT_ENCODING_MAX_BYTES = 16384
+_CHARSET = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+def declared_charset(content_type: str | None) -> str | None:
+    """Returns the charset of a Content-Type header if it names a known codec"""
+    if not content_type:
+        return None
+    match = _CHARSET.search(content_type)
+    if match is None:
+        return None
+    try:
+        return codecs.lookup(match.group(1)).name
+    except LookupError:
+        return None
+
+
+def record_content_type(record) -> str | None:
+    """Returns the HTTP Content-Type of a WARC record, None if it has no HTTP headers"""
+    return record.http_headers.get("Content-Type") if record.http_headers is not None else None
+
+
+def extract_text(inp: bytes, content_type: str | None = None) -> str:
+    """Extracts the plain text of an HTML payload.
+
+    The charset declared in `content_type` is trusted when there is one. Otherwise pure ASCII
+    and valid UTF-8 payloads are decoded as UTF-8, and only the rest goes through encoding
+    detection, on a bounded prefix and suffix. When the encoding is known upfront the bytes
+    are handed to resiliparse directly, without an intermediate decoded copy.
+    """
+    encoding = declared_charset(content_type)
+    if encoding is None and inp.isascii():
+        encoding = "utf-8"
+    if encoding is not None:
+        return html2text.extract_plain_text(HTMLTree.parse_from_bytes(inp, encoding, errors="replace"))
+    try:
+        decoded = inp.decode("utf-8")
+    except UnicodeDecodeError:
+        encoding = parse.encoding.detect_encoding(inp, max_len=DETECT_ENCODING_MAX_BYTES)
+        decoded = inp.decode(encoding, errors="replace")
+    return html2text.extract_plain_text(decoded)
 
 
-model_path_prefix = "/home/shared/" if platform.system() != "Darwin" else "./models/"
-default_lang_model = fasttext.load_model(model_path_prefix + "lid.176.bin")
-default_nsfw_model = fasttext.load_model(model_path_prefix + "dolma-jigsaw-fasttext-bigrams-nsfw.bin")
-default_toxic_model = fasttext.load_model(model_path_prefix + "dolma-jigsaw-fasttext-bigrams-hatespeech.bin")
-default_quality_model = fasttext.load_model("quality_model.ftz")
+def _predict(model, text: str) -> tuple[str, float]:
+    labels, scores = model.predict(text, k=1)
+    return labels[0], scores[0]
 
 
-def extract_text(inp: bytes) -> str:
-    encoding = parse.encoding.detect_encoding(inp)
-    decoded = inp.decode(encoding, errors="replace")
-    return html2text.extract_plain_text(decoded)
+def _predict_batch(model, texts: list[str], normalized: bool = False) -> list[tuple[str, float]]:
+    if not normalized:
+        texts = [text.replace("\n", " ") for text in texts]
+    labels, scores = model.predict(texts, k=1)
+    return [(l[0], float(v[0])) for l, v in zip(labels, scores)]
 
 
 def identify_language(text: str, model: str | None = None) -> tuple[str, float]:
     if model is None:
-        model = default_lang_model
+        model = get_model("lang")
     else:
-        model = fasttext.load_model(model)
-    results = model.predict(text.replace("\n", " "), k=1)
-    results = [(l, v) for l, v in zip(*results)]
-    return sorted(results, key=lambda x: x[1], reverse=True)[0]
+        model = load_model(model)
+    return _predict(model, text.replace("\n", " "))
+
+
+def identify_language_batch(texts: list[str], model: str | None = None) -> list[tuple[str, float]]:
+    """Batched identify_language, returns one (label, score) per text in input order"""
+    if not texts:
+        return []
+    model = get_model("lang") if model is None else load_model(model)
+    return _predict_batch(model, texts)
 
 
 def identify_quality(text: str, model: str | None = None) -> tuple[str, float]:
     if model is None:
-        model = default_quality_model
+        model = get_model("quality")
     else:
-        model = fasttext.load_model(model)
-    results = model.predict(text.replace("\n", " "), k=1)
-    results = [(l, v) for l, v in zip(*results)]
-    return sorted(results, key=lambda x: x[1], reverse=True)[0]
+        model = load_model(model)
+    return _predict(model, text.replace("\n", " "))
+
+
+def identify_quality_batch(texts: list[str], model: str | None = None) -> list[tuple[str, float]]:
+    """Batched identify_quality, returns one (label, score) per text in input order"""
+    if not texts:
+        return []
+    model = get_model("quality") if model is None else load_model(model)
+    return _predict_batch(model, texts)
+
+
+EMAIL_PATTERN = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
+PHONE_PATTERN = re.compile(r"(\b\d{3}[-.]?\d{3}[-.]?\d{4}\b)|(\+\d{1,2}\s?\(?\d{2,3}\)?\s?\d{3,4}[-.]?\d{4})|(\b\d{2,4}[-.]?\d{2,4}[-.]?\d{2,4}\b)")
+IPV4_PATTERN = re.compile(r"\b(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b")
+
+# PII type -> (pattern, replacement), in the order mask_pii tries them at each position
+PII_TYPES = {
+    "email": (EMAIL_PATTERN, "|||EMAIL_ADDRESS|||"),
+    "phone": (PHONE_PATTERN, "|||PHONE_NUMBER|||"),
+    "ip": (IPV4_PATTERN, "|||IP_ADDRESS|||"),
+}
+PII_PATTERN = re.compile("|".join(f"(?P<{name}>{pattern.pattern})" for name, (pattern, _) in PII_TYPES.items()))
+_DIGIT = re.compile(r"\d")
 
 
 def mask_emails(text: str) -> tuple[str, int]:
-    masked_text, num_masks = re.subn(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+", "|||EMAIL_ADDRESS|||", text)
+    masked_text, num_masks = EMAIL_PATTERN.subn("|||EMAIL_ADDRESS|||", text)
     return masked_text, num_masks
 
 
 def mask_phone_numbers(text: str) -> tuple[str, int]:
-    masked_text, num_masks = re.subn(
-        r"(\b\d{3}[-.]?\d{3}[-.]?\d{4}\b)|(\+\d{1,2}\s?\(?\d{2,3}\)?\s?\d{3,4}[-.]?\d{4})|(\b\d{2,4}[-.]?\d{2,4}[-.]?\d{2,4}\b)", "|||PHONE_NUMBER|||", text)
+    masked_text, num_masks = PHONE_PATTERN.subn("|||PHONE_NUMBER|||", text)
     return masked_text, num_masks
 
 
 def mask_ipv4(text: str) -> tuple[str, int]:
-    masked_text, num_masks = re.subn(r"\b(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b", "|||IP_ADDRESS|||", text)
+    masked_text, num_masks = IPV4_PATTERN.subn("|||IP_ADDRESS|||", text)
     return masked_text, num_masks
 
 
+def mask_pii(text: str) -> tuple[str, dict[str, int]]:
+    """Masks emails, phone numbers and IPv4 addresses in a single scan of the text.
+
+    Returns the masked text and the number of masks per PII type. Matches the result of
+    mask_emails, mask_phone_numbers and mask_ipv4 applied in sequence, except where
+    matches of different types overlap: here the match that starts first wins.
+    """
+    counts = dict.fromkeys(PII_TYPES, 0)
+    # Emails need an "@", phone numbers and IPs need digits
+    if "@" not in text and _DIGIT.search(text) is None:
+        return text, counts
+
+    def replace(match: re.Match) -> str:
+        counts[match.lastgroup] += 1
+        return PII_TYPES[match.lastgroup][1]
+
+    return PII_PATTERN.sub(replace, text), counts
+
+
 def classify_nsfw(text: str, model: str | None = None) -> tuple[str, float]:
     if model is None:
-        model = default_nsfw_model
+        model = get_model("nsfw")
     else:
-        model = fasttext.load_model(model)
-    results = model.predict(text.replace("\n", " "), k=1)
-    results = [(l, v) for l, v in zip(*results)]
-    return sorted(results, key=lambda x: x[1], reverse=True)[0]
+        model = load_model(model)
+    return _predict(model, text.replace("\n", " "))
+
+
+def classify_nsfw_batch(texts: list[str], model: str | None = None) -> list[tuple[str, float]]:
+    """Batched classify_nsfw, returns one (label, score) per text in input order"""
+    if not texts:
+        return []
+    model = get_model("nsfw") if model is None else load_model(model)
+    return _predict_batch(model, texts)
 
 
 def classify_toxic_speech(text: str, model: str | None = None) -> tuple[str, float]:
     if model is None:
-        model = default_toxic_model
+        model = get_model("toxic")
     else:
-        model = fasttext.load_model(model)
-    results = model.predict(text.replace("\n", " "), k=1)
-    results = [(l, v) for l, v in zip(*results)]
-    return sorted(results, key=lambda x: x[1], reverse=True)[0]
+        model = load_model(model)
+    return _predict(model, text.replace("\n", " "))
+
+
+def classify_toxic_speech_batch(texts: list[str], model: str | None = None) -> list[tuple[str, float]]:
+    """Batched classify_toxic_speech, returns one (label, score) per text in input order"""
+    if not texts:
+        return []
+    model = get_model("toxic") if model is None else load_model(model)
+    return _predict_batch(model, texts)
+
+
+# (model, accepted label, minimum score) per classifier, cheapest first. A model is either a
+# name registered in cs336_data.models or a path; an accepted label of None never rejects.
+DEFAULT_CLASSIFIERS = [
+    ("lang", "__label__en", 0.65),
+    ("nsfw", "__label__non-nsfw", 0.9),
+    ("toxic", "__label__non-toxic", 0.9),
+]
+
+
+def _resolve_model(model: str):
+    return get_model(model) if model in DEFAULT_MODEL_PATHS else load_model(model)
 
 
-def gopher_filters(text: str) -> bool:
-    """Returns bool indicating whether to keep the document"""
+def classify_batch(texts: list[str], model: str, normalized: bool = False) -> list[tuple[str, float]]:
+    """Batched prediction of a classifier given by registered name or path, returns one
+    (label, score) per text; `normalized` texts already have their newlines replaced"""
+    return _predict_batch(_resolve_model(model), texts, normalized)
+
+
+GOPHER_MAX_WORDS = 100000
+# Cheap alternatives to nltk.word_tokenize: "regex" splits words from runs of punctuation
+# like the Treebank tokenizer mostly does, "whitespace" only splits on whitespace
+GOPHER_TOKENIZERS = {
+    "regex": re.compile(r"\w+|[^\w\s]+"),
+    "whitespace": re.compile(r"\S+"),
+}
+_ALPHA = re.compile(r"[^\W\d_]")
+
+
+def _gopher_filters_fast(text: str, pattern: re.Pattern) -> bool:
+    # A token covers at least one character, so only texts longer than the word limit can
+    # exceed it; for those, stop tokenizing as soon as the limit is passed
+    if len(text) > GOPHER_MAX_WORDS:
+        words = [m.group() for m in itertools.islice(pattern.finditer(text), GOPHER_MAX_WORDS + 1)]
+    else:
+        words = pattern.findall(text)
+    num_words = len(words)
+    if num_words < 50 or num_words > GOPHER_MAX_WORDS:
+        return False
+    # Word length and alphabetic counts in one pass over the tokens
+    num_chars = num_alpha = 0
+    search = _ALPHA.search
+    for word in words:
+        num_chars += len(word)
+        if search(word):
+            num_alpha += 1
+    if not 3 <= num_chars / num_words <= 10 or num_alpha / num_words < 0.8:
+        return False
+    lines = text.splitlines()
+    return sum(line.endswith("...") for line in lines) / len(lines) <= 0.3
+
+
+def gopher_filters(text: str, tokenizer: str = "nltk") -> bool:
+    """Returns bool indicating whether to keep the document
+
+    `tokenizer` is "nltk" for nltk.word_tokenize or one of the much cheaper GOPHER_TOKENIZERS.
+    """
+    if tokenizer != "nltk":
+        return _gopher_filters_fast(text, GOPHER_TOKENIZERS[tokenizer])
+    ensure_punkt()
     words = nltk.word_tokenize(text)
 
     # Filter out documents with less than 50 words or more than 100,000 words
@@ -125,16 +281,8 @@ def deduplicate_lines(paths: list[os.PathLike], output_dir: os.PathLike):
                         out.write(line)
 
 
-def compute_minhash(ngrams: list[str], seed: int):
-    minhash = float("inf")
-    for ngram in ngrams:
-        h = mmh3.hash(ngram, seed)
-        if h < minhash:
-            minhash = h
-    return minhash
-
-
-def normalize_text(text: str):
+def normalize_text_regex(text: str):
+    """Reference normalize_text, one full pass over the text per step"""
     text = text.lower()
     # Normalize whitespace
     text = re.sub(r'\s+', ' ', text)
@@ -145,70 +293,69 @@ def normalize_text(text: str):
     return text
 
 
+_WORD_OR_SPACE = re.compile(r"[\w\s]")
+
+
+class _NormalizationTable(dict):
+    """str.translate table mapping a code point to its lowercased, punctuation-free, ASCII-folded
+    form, computed on first use. The whole pipeline of normalize_text_regex after whitespace
+    collapsing is per character: NFD only reorders combining marks, which are dropped anyway.
+    """
+
+    def __missing__(self, codepoint: int) -> str:
+        lowered = chr(codepoint).lower()
+        kept = "".join(c for c in lowered if _WORD_OR_SPACE.match(c))
+        value = unicodedata.normalize("NFD", kept).encode("ascii", "ignore").decode("ascii")
+        self[codepoint] = value
+        return value
+
+    def precompute(self, codepoints: range):
+        for codepoint in codepoints:
+            self[codepoint]
+
+
+# ASCII and the Latin blocks are filled in upfront so that most text never misses the table
+NORMALIZATION_TABLE = _NormalizationTable()
+NORMALIZATION_TABLE.precompute(range(0x250))
+
+
+_ASCII_PUNCTUATION = bytes(c for c in range(128) if not _WORD_OR_SPACE.match(chr(c)))
+
+
+def _collapse_whitespace(text: str) -> str:
+    # str.split and the \s regex class agree on what is whitespace, and joining the words is
+    # much faster than re.sub; only the leading and trailing runs have to be restored
+    words = text.split()
+    if not words:
+        return " " if text else ""
+    collapsed = " ".join(words)
+    if text[0].isspace():
+        collapsed = " " + collapsed
+    if text[-1].isspace():
+        collapsed += " "
+    return collapsed
+
+
+def normalize_text(text: str):
+    """Same output as normalize_text_regex in two passes: whitespace collapsing, then one
+    translation, through bytes for ASCII text and NORMALIZATION_TABLE otherwise"""
+    text = _collapse_whitespace(text)
+    if text.isascii():
+        return text.encode("ascii").lower().translate(None, _ASCII_PUNCTUATION).decode("ascii")
+    return text.translate(NORMALIZATION_TABLE)
+
+
 def compute_ngrams(text: str, ngram_length: int):
     return [text[i:i+ngram_length] for i in range(len(text) - ngram_length + 1)]
 
 
-def jaccard_distance(set1: set, set2: set):
-    return len(set1.intersection(set2)) / len(set1.union(set2))
-
+def document_ngrams(text: str, ngram_length: int) -> list[str]:
+    """compute_ngrams, but a non-empty text shorter than `ngram_length` is its own single
+    n-gram, so that short documents are only duplicates of identical ones"""
+    if 0 < len(text) < ngram_length:
+        return [text]
+    return compute_ngrams(text, ngram_length)
 
-def dfs(edges: dict, node: os.PathLike, visited: set) -> set[os.PathLike]:
-    visited.add(node)
-    cluster = {node}
-    for neighbor in edges[node]:
-        if neighbor not in visited:
-            cluster |= dfs(edges, neighbor, visited)
-    return cluster
 
-def deduplicate_fuzzy(all_paths: list[os.PathLike], num_hashes: int, num_bands: int, ngram_length: int, output_dir: os.PathLike, threshold: float):
-    clusters = {i: {} for i in range(num_bands)}
-    for path in all_paths:
-        with open(path, "r") as f:
-            text = f.read()
-            text = normalize_text(text)
-            ngrams = compute_ngrams(text, ngram_length)
-            min_hashes = [compute_minhash(ngrams, i) for i in range(num_hashes)]
-            for band in range(num_bands):
-                band_hashes = tuple(min_hashes[band * (num_hashes // num_bands):(band + 1) * (num_hashes // num_bands)])
-                if band_hashes not in clusters[band]:
-                    clusters[band][band_hashes] = []
-                clusters[band][band_hashes].append(path)
-
-    edges = {}
-    for band in range(num_bands):
-        for paths in clusters[band].values():
-            if len(paths) == 1:
-                continue
-            ngram_cache = {}
-            for i in range(len(paths)):
-                for j in range(i + 1, len(paths)):
-                    if paths[i] not in ngram_cache:
-                        with open(paths[i], "r") as f:
-                            ngram_cache[paths[i]] = set(compute_ngrams(normalize_text(f.read()), ngram_length))
-                    if paths[j] not in ngram_cache:
-                        with open(paths[j], "r") as f:
-                            ngram_cache[paths[j]] = set(compute_ngrams(normalize_text(f.read()), ngram_length))
-                    if jaccard_distance(ngram_cache[paths[i]], ngram_cache[paths[j]]) >= threshold:
-                        if paths[i] not in edges:
-                            edges[paths[i]] = set()
-                        edges[paths[i]].add(paths[j])
-                        if paths[j] not in edges:
-                            edges[paths[j]] = set()
-                        edges[paths[j]].add(paths[i])
-
-    visited = set()
-    keep = set(all_paths)
-    while len(edges) > 0:
-        node = next(iter(edges))
-        cluster = dfs(edges, node, visited)
-        edges = {k: v for k, v in edges.items() if k not in cluster}
-        keep_idx = random.randint(0, len(cluster) - 1)
-        cluster = list(cluster)
-        cluster.pop(keep_idx)
-        keep -= set(cluster)
-
-    for path in keep:
-        with open(path, "r") as f:
-            with open(output_dir / path.name, "w") as out:
-                out.write(f.read())
+def jaccard_distance(set1: set, set2: set):
+    return len(set1.intersection(set2)) / len(set1.union(set2))
@@ -0,0 +1,239 @@
+import os
+import json
+from xopen import xopen
+
+
+# Fields of the structured output formats, in column order
+OUTPUT_FIELDS = ("url", "record_id", "scores", "pii", "text")
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+DEFAULT_BUFFER_RECORDS = 1000
+
+
+def _fsync(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+class TextWriter:
+    """The original single-file output: the HTTP headers and text of each record, blank-line separated.
+
+    With a `state` from `checkpoint`, the file is cut back to the checkpoint and appended to.
+    """
+
+    can_checkpoint = True
+
+    def __init__(self, path: str, state: dict | None = None):
+        self.path = path
+        self.paths = [path]
+        if state is not None:
+            os.truncate(path, state["size"])
+            self._file = open(path, "a")
+        else:
+            self._file = open(path, "w")
+
+    def write(self, record: dict):
+        self._file.write(record["http_headers"] + record["text"] + "\n\n")
+
+    def checkpoint(self) -> dict:
+        """Makes everything written so far durable and returns the state to resume from"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"size": os.path.getsize(self.path)}
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardedWriter:
+    """Buffers records and writes them in bulk to shards `{prefix}-00000{suffix}`, `-00001`, ...
+
+    A new shard is started once the current one holds `shard_bytes` of uncompressed data,
+    checked after every bulk write of `buffer_records` records, so that downstream jobs can
+    read the shards in parallel. Subclasses implement `_open`, `_write_batch` returning the
+    uncompressed size written, and `_close`.
+
+    `checkpoint` closes the current shard so that it is complete on disk. Appendable formats
+    reopen it in append mode for the next write, which for gzip and zstd starts a new
+    member or frame, so the shard stays one valid stream. Other formats can only be
+    checkpointed while no shard is open, i.e. after a rollover and before the next bulk
+    write, and keep their buffered records in the checkpoint state instead of writing them.
+    `restore` cuts the output back to a checkpoint.
+    """
+
+    suffix = ""
+    appendable = False
+
+    def __init__(self, prefix: str, shard_bytes: int = DEFAULT_SHARD_BYTES, buffer_records: int = DEFAULT_BUFFER_RECORDS):
+        self.prefix = prefix
+        self.shard_bytes = shard_bytes
+        self.buffer_records = buffer_records
+        self.paths = []
+        self._buffer = []
+        self._shard_size = 0
+        self._file = None
+        self._reopen = False
+
+    def shard_path(self, index: int) -> str:
+        return f"{self.prefix}-{index:05d}{self.suffix}"
+
+    def write(self, record: dict):
+        self._buffer.append({field: record.get(field) for field in OUTPUT_FIELDS})
+        if len(self._buffer) >= self.buffer_records:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        if self._file is None:
+            if self._reopen:
+                self._file = self._open(self.paths[-1], append=True)
+            else:
+                self.paths.append(self.shard_path(len(self.paths)))
+                self._file = self._open(self.paths[-1], append=False)
+                self._shard_size = 0
+            self._reopen = False
+        self._shard_size += self._write_batch(self._buffer)
+        self._buffer = []
+        if self._shard_size >= self.shard_bytes:
+            self._close()
+            self._file = None
+
+    @property
+    def can_checkpoint(self) -> bool:
+        """Whether `checkpoint` can run without ending the current shard early"""
+        return self.appendable or self._file is None
+
+    def checkpoint(self) -> dict:
+        """Makes everything written so far durable and returns the state to resume from"""
+        if not self.can_checkpoint:
+            raise RuntimeError(f"{type(self).__name__} cannot checkpoint while shard {self.paths[-1]} is open")
+        if self.appendable:
+            self.flush()
+            if self._file is not None:
+                self._close()
+                self._file = None
+                self._reopen = True
+        if self.paths:
+            _fsync(self.paths[-1])
+        return {
+            "paths": list(self.paths),
+            "shard_size": self._shard_size,
+            "file_size": os.path.getsize(self.paths[-1]) if self.paths else 0,
+            "reopen": self._reopen,
+            "buffer": list(self._buffer),
+        }
+
+    def restore(self, state: dict):
+        """Drops everything written after `state` was checkpointed and resumes from it"""
+        self.paths = list(state["paths"])
+        self._shard_size = state["shard_size"]
+        self._reopen = state["reopen"]
+        self._buffer = list(state["buffer"])
+        if self.paths:
+            os.truncate(self.paths[-1], state["file_size"])
+        index = len(self.paths)
+        while os.path.exists(self.shard_path(index)):
+            os.remove(self.shard_path(index))
+            index += 1
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonlWriter(ShardedWriter):
+    """JSON lines shards, compressed according to `compression`: None, "gzip" or "zstd".
+
+    zstd needs the zstandard package or a zstd binary, which xopen picks up.
+    """
+
+    SUFFIXES = {None: ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+    appendable = True
+
+    def __init__(self, prefix: str, compression: str | None = "gzip", shard_bytes: int = DEFAULT_SHARD_BYTES, buffer_records: int = DEFAULT_BUFFER_RECORDS):
+        if compression not in self.SUFFIXES:
+            raise ValueError(f"compression must be one of {list(self.SUFFIXES)}, got {compression}")
+        super().__init__(prefix, shard_bytes, buffer_records)
+        self.suffix = self.SUFFIXES[compression]
+
+    def _open(self, path: str, append: bool):
+        return xopen(path, "ab" if append else "wb")
+
+    def _write_batch(self, records: list[dict]) -> int:
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode()
+        self._file.write(data)
+        return len(data)
+
+    def _close(self):
+        self._file.close()
+
+
+class ParquetWriter(ShardedWriter):
+    """Parquet shards with one row group per bulk write; needs pyarrow.
+
+    Scores and PII counts are stored as JSON strings, since their keys depend on the
+    filters and PII types enabled.
+    """
+
+    suffix = ".parquet"
+
+    def __init__(self, prefix: str, shard_bytes: int = DEFAULT_SHARD_BYTES, buffer_records: int = DEFAULT_BUFFER_RECORDS):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow, install it with `pip install pyarrow`") from e
+        super().__init__(prefix, shard_bytes, buffer_records)
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.schema = pyarrow.schema([(field, pyarrow.string()) for field in OUTPUT_FIELDS])
+
+    def _open(self, path: str, append: bool):
+        return self._pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def _write_batch(self, records: list[dict]) -> int:
+        columns = {
+            field: [json.dumps(r[field]) if field in ("scores", "pii") else r[field] for r in records]
+            for field in OUTPUT_FIELDS
+        }
+        self._file.write_table(self._pa.Table.from_pydict(columns, schema=self.schema))
+        return sum(len(value) for column in columns.values() for value in column if value is not None)
+
+    def _close(self):
+        self._file.close()
+
+
+OUTPUT_FORMATS = ("text", "jsonl", "jsonl.gz", "jsonl.zst", "parquet")
+
+
+def make_writer(output_format: str, output_path: str, shard_bytes: int = DEFAULT_SHARD_BYTES, buffer_records: int = DEFAULT_BUFFER_RECORDS, state: dict | None = None):
+    """Returns the writer of `output_format`, resumed from a checkpointed `state` if given.
+
+    Sharded formats use `output_path` as shard prefix.
+    """
+    if output_format == "text":
+        return TextWriter(output_path, state)
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}, got {output_format}")
+    if output_format == "parquet":
+        writer = ParquetWriter(output_path, shard_bytes, buffer_records)
+    else:
+        compression = {"jsonl": None, "jsonl.gz": "gzip", "jsonl.zst": "zstd"}[output_format]
+        writer = JsonlWriter(output_path, compression, shard_bytes, buffer_records)
+    if state is not None:
+        writer.restore(state)
+    return writer
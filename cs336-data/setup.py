@@ -30,5 +30,9 @@ setup(
     long_description_content_type="text/markdown",
     packages=find_packages(exclude=["tests", ".github"]),
     install_requires=read_requirements("requirements.txt"),
-    extras_require={"test": read_requirements("requirements-test.txt")},
+    extras_require={
+        "test": read_requirements("requirements-test.txt"),
+        "parquet": ["pyarrow"],
+        "zstd": ["zstandard"],
+    },
 )
@@ -71,7 +71,7 @@ def run_minhash_deduplication(
     jaccard_threshold: float,
     output_directory: os.PathLike,
 ):
-    from cs336_data.utils import deduplicate_fuzzy
+    from cs336_data.dedup import deduplicate_fuzzy
     deduplicate_fuzzy(
         input_files,
         num_hashes,
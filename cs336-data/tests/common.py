@@ -2,3 +2,35 @@
 import pathlib
 
 FIXTURES_PATH = (pathlib.Path(__file__).resolve().parent) / "fixtures"
+
+
+def write_warc(path, bodies: list[str], urls: list[str] | None = None, content_types: list[str] | None = None, statuses: list[str] | None = None):
+    with open(path, "wb") as f:
+        for i, body in enumerate(bodies):
+            url = urls[i] if urls else f"http://example.com/{i}"
+            content_type = content_types[i] if content_types else "text/html; charset=utf-8"
+            status = statuses[i] if statuses else "200 OK"
+            html = f"<html><body><p>{body}</p></body></html>".encode()
+            http = f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n".encode() + f"Content-Length: {len(html)}\r\n\r\n".encode() + html
+            headers = (
+                "WARC/1.0\r\n"
+                "WARC-Type: response\r\n"
+                f"WARC-Target-URI: {url}\r\n"
+                f"WARC-Record-ID: <urn:uuid:00000000-0000-0000-0000-{i:012d}>\r\n"
+                "Content-Type: application/http; msgtype=response\r\n"
+                f"Content-Length: {len(http)}\r\n\r\n"
+            ).encode()
+            f.write(headers + http + b"\r\n\r\n")
+
+
+def train_tiny_model(tmp_path):
+    import fasttext
+
+    train_path = tmp_path / "train.txt"
+    train_path.write_text(
+        "__label__a hello world foo\n__label__b bar baz qux\n" * 50
+    )
+    model = fasttext.train_supervised(str(train_path), epoch=5, thread=1, verbose=0)
+    model_path = tmp_path / "tiny.bin"
+    model.save_model(str(model_path))
+    return str(model_path)
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 import logging
 
+import pytest
 from xopen import xopen
 
 from .adapters import run_exact_line_deduplication, run_minhash_deduplication
-from .common import FIXTURES_PATH
+from .common import FIXTURES_PATH, write_warc
 
 logger = logging.getLogger(__name__)
 
@@ -131,3 +132,310 @@ def test_minhash_deduplication_fuzzy_duplicates(tmp_path):
     assert len(deduplicated_documents) == 0
     # One of the kept deduplicated documents should be kept, and the other should be removed.
     assert len(kept_duplicated_documents) == 1
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+@pytest.mark.parametrize("hash_bits,num_partitions", [(64, 1), (64, 7), (128, 4)])
+def test_exact_line_deduplication_partitioned(tmp_path, hash_bits, num_partitions, parallel):
+    from cs336_data.dedup import deduplicate_lines_parallel, deduplicate_lines_partitioned
+
+    documents_with_line_duplicates_paths = list(
+        (FIXTURES_PATH / "documents_with_line_duplicates").glob("doc*.txt")
+    )
+    expected = {}
+    for path in (FIXTURES_PATH / "documents_line_deduplicated").glob("doc*.txt"):
+        with open(path) as f:
+            expected[path.name] = f.read()
+
+    if parallel:
+        deduplicate_lines_parallel(
+            documents_with_line_duplicates_paths,
+            tmp_path,
+            num_workers=2,
+            num_partitions=num_partitions,
+            hash_bits=hash_bits,
+        )
+    else:
+        deduplicate_lines_partitioned(
+            documents_with_line_duplicates_paths,
+            tmp_path,
+            num_partitions=num_partitions,
+            hash_bits=hash_bits,
+        )
+    output_filepaths = list(tmp_path.glob("*"))
+    assert len(output_filepaths) == 5
+    for filepath in output_filepaths:
+        with xopen(filepath) as f:
+            assert f.read() == expected[filepath.name]
+
+
+def test_minhash_signatures_estimate_jaccard():
+    from cs336_data.minhash import minhash_signatures
+    from cs336_data.utils import compute_ngrams, jaccard_distance, normalize_text
+
+    with open(FIXTURES_PATH / "documents_with_fuzzy_duplicates" / "rails_mit_license.txt") as f:
+        rails = compute_ngrams(normalize_text(f.read()), 5)
+    with open(FIXTURES_PATH / "documents_with_fuzzy_duplicates" / "react_mit_license.txt") as f:
+        react = compute_ngrams(normalize_text(f.read()), 5)
+
+    signatures = minhash_signatures([rails, react, rails, []], num_hashes=500, seed=1)
+    assert signatures.shape == (4, 500)
+    assert (signatures[0] == signatures[2]).all()
+    estimate = (signatures[0] == signatures[1]).mean()
+    assert abs(estimate - jaccard_distance(set(rails), set(react))) < 0.1
+    assert not (signatures[3] == signatures[0]).any()
+
+
+@pytest.mark.parametrize("estimate_jaccard,keep_ngrams", [(False, False), (False, True), (True, False)])
+def test_minhash_deduplication_incremental(tmp_path, monkeypatch, estimate_jaccard, keep_ngrams):
+    import shutil
+    from cs336_data.dedup import deduplicate_fuzzy_incremental
+
+    fuzzy_dir = FIXTURES_PATH / "documents_with_fuzzy_duplicates"
+    exact_dir = FIXTURES_PATH / "documents_with_line_duplicates"
+    store_dir = tmp_path / "store"
+    params = dict(num_hashes=500, num_bands=50, ngram_length=5, threshold=0.8, estimate_jaccard=estimate_jaccard, keep_ngrams=keep_ngrams)
+
+    first_output = tmp_path / "first"
+    first_output.mkdir()
+    first_batch = [fuzzy_dir / "rails_mit_license.txt", fuzzy_dir / "pytorch_license.txt"]
+    kept = deduplicate_fuzzy_incremental(first_batch, store_dir, first_output, **params)
+    assert kept == first_batch
+
+    assert (store_dir / "ngrams.bin").exists() == keep_ngrams
+    # Unless exact verification reads them back, the first outputs need not stay in place
+    if estimate_jaccard or keep_ngrams:
+        shutil.rmtree(first_output)
+
+    # react is a fuzzy duplicate of rails from the first batch, doc2 an exact duplicate of doc1.
+    # The output directory is relative to a different working directory this time.
+    second_output = tmp_path / "second"
+    second_output.mkdir()
+    monkeypatch.chdir(tmp_path)
+    second_batch = [fuzzy_dir / "react_mit_license.txt", exact_dir / "doc1.txt", exact_dir / "doc2.txt"]
+    kept = deduplicate_fuzzy_incremental(second_batch, store_dir, "second", **params)
+    assert kept == [exact_dir / "doc1.txt"]
+    assert [p.name for p in second_output.glob("*")] == ["doc1.txt"]
+    assert (store_dir / "paths.txt").read_text().splitlines()[-1] == str(second_output / "doc1.txt")
+
+
+def test_union_find_clusters_long_chain():
+    from cs336_data.dedup import UnionFind, cluster_representatives
+
+    # A chain this long would exceed the recursion limit of a recursive DFS
+    n = 50000
+    union_find = UnionFind(n + 2)
+    for i in range(n - 1):
+        assert union_find.union(i, i + 1)
+    assert not union_find.union(0, n - 1)
+    assert union_find.clusters() == [list(range(n))]
+    assert cluster_representatives(union_find, seed=3) == cluster_representatives(union_find, seed=3)
+
+
+def test_minhash_deduplication_estimated_jaccard(tmp_path):
+    from cs336_data.dedup import deduplicate_fuzzy
+
+    paths = list((FIXTURES_PATH / "documents_with_fuzzy_duplicates").glob("*.txt"))
+    deduplicate_fuzzy(paths, 500, 50, 5, tmp_path, 0.8, estimate_jaccard=True, cache_size=1)
+    output_names = {p.name for p in tmp_path.glob("*")}
+    assert "pytorch_license.txt" in output_names
+    assert len(output_names) == 2
+
+
+@pytest.mark.parametrize("num_workers,estimate_jaccard,chunk_rows", [(1, False, 4096), (3, False, 1), (3, True, 1)])
+def test_minhash_deduplication_parallel(tmp_path, num_workers, estimate_jaccard, chunk_rows):
+    from cs336_data.dedup import deduplicate_fuzzy_parallel
+
+    paths = list((FIXTURES_PATH / "documents_with_fuzzy_duplicates").glob("*.txt"))
+    paths += list((FIXTURES_PATH / "documents_with_line_duplicates").glob("doc*.txt"))
+    deduplicate_fuzzy_parallel(paths, 500, 50, 5, tmp_path, 0.8, estimate_jaccard=estimate_jaccard, num_workers=num_workers, chunk_rows=chunk_rows)
+    output_names = {p.name for p in tmp_path.glob("*")}
+    # One of the two MIT licenses and one of the identical doc1/doc2 are removed
+    assert len(output_names) == len(paths) - 2
+    assert {"pytorch_license.txt", "doc3.txt", "doc4.txt", "doc5.txt"} <= output_names
+
+
+@pytest.mark.parametrize("suffix,cache_size", [(".jsonl", 1024), (".jsonl.gz", 1024), (".jsonl.gz", 2)])
+def test_minhash_deduplication_records_jsonl(tmp_path, monkeypatch, suffix, cache_size):
+    import gzip
+    import json
+    from cs336_data import records
+    from cs336_data.records import deduplicate_fuzzy_records, iter_records
+
+    paths = sorted((FIXTURES_PATH / "documents_with_fuzzy_duplicates").glob("*.txt"))
+    shards = [tmp_path / f"shard-{i}{suffix}" for i in range(2)]
+    for i, shard in enumerate(shards):
+        with (gzip.open if suffix.endswith(".gz") else open)(shard, "wt") as f:
+            for path in paths[i::2]:
+                f.write(json.dumps({"id": path.name, "text": path.read_text()}) + "\n")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    opened = []
+    open_shard = records.open_shard
+    monkeypatch.setattr(records, "open_shard", lambda path, mode="rb": opened.append(str(path)) or open_shard(path, mode))
+    removed = deduplicate_fuzzy_records(shards, output_dir, 500, 50, 5, 0.8, cache_size=cache_size, work_dir=tmp_path)
+    assert sum(removed.values()) == 1
+    # Each shard is read once to sign and once to write its output, however small the cache
+    assert sorted(opened) == sorted(str(path) for path in shards + shards + [output_dir / shard.name for shard in shards])
+
+    kept = [text for shard in shards for _, text in iter_records(output_dir / shard.name)]
+    assert len(kept) == len(paths) - 1
+    assert (FIXTURES_PATH / "documents_with_fuzzy_duplicates" / "pytorch_license.txt").read_text() in kept
+
+
+def test_minhash_deduplication_records_warc(tmp_path):
+    from fastwarc import ArchiveIterator
+    from cs336_data.records import deduplicate_fuzzy_records
+
+    bodies = ["the quick brown fox jumps over the lazy dog " * 20, "an entirely different page about something else", "the quick brown fox jumps over the lazy dog " * 20, "the quick brown fox jumps over the lazy dog " * 21]
+    warc_path = tmp_path / "a.warc"
+    write_warc(warc_path, bodies)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    assert deduplicate_fuzzy_records([warc_path], output_dir, 100, 20, 5, 0.8, cache_size=2) == {str(warc_path): 2}
+
+    with open(output_dir / "a.warc", "rb") as f:
+        uris = [record.headers["WARC-Target-URI"] for record in ArchiveIterator(f)]
+    assert len(uris) == 2 and "http://example.com/1" in uris
+
+
+def test_exact_line_deduplication_records(tmp_path):
+    import json
+    from cs336_data.records import deduplicate_lines_records, iter_records
+
+    shard = tmp_path / "shard.jsonl"
+    texts = ["header\nunique a\nfooter\n", "header\nunique b\nfooter\n", "header\nfooter\n"]
+    shard.write_text("".join(json.dumps({"text": text}) + "\n" for text in texts))
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    deduplicate_lines_records([shard], output_dir, num_partitions=3)
+    assert [text for _, text in iter_records(output_dir / "shard.jsonl")] == ["unique a\n", "unique b\n"]
+
+
+@pytest.mark.parametrize("memory_bytes", [None, 1 << 16])
+def test_exact_line_deduplication_bloom(tmp_path, memory_bytes):
+    from cs336_data.dedup import deduplicate_lines_bloom
+
+    input_paths = sorted((FIXTURES_PATH / "documents_with_line_duplicates").glob("doc*.txt"))
+    report = deduplicate_lines_bloom(input_paths, tmp_path, false_positive_rate=1e-6, memory_bytes=memory_bytes)
+    assert report["expected_over_removal_rate"] < 1e-3
+    for path in input_paths:
+        expected = (FIXTURES_PATH / "documents_line_deduplicated" / path.name).read_text()
+        assert (tmp_path / path.name).read_text() == expected
+
+
+def test_bloom_filter_false_positive_rate():
+    from cs336_data.dedup import BloomFilter, bloom_parameters, hash_lines
+
+    num_bits, num_hashes = bloom_parameters(10000, 0.01)
+    bloom = BloomFilter(num_bits, num_hashes)
+    bloom.add(hash_lines([f"line {i}\n" for i in range(10000)], 128))
+    assert bloom.contains(hash_lines([f"line {i}\n" for i in range(10000)], 128)).all()
+    false_positives = bloom.contains(hash_lines([f"other {i}\n" for i in range(10000)], 128)).mean()
+    assert false_positives < 0.02
+    assert abs(bloom.false_positive_rate() - 0.01) < 0.005
+
+
+@pytest.mark.parametrize("text", [
+    "", " ", "\t\n", "  Hello,   World!\n", "a , b", "Ünïcödé façade — naïve café", "İSTANBUL Σίσυφος ΣΑΣ", "東京　タワー ok", "ﬁné _under_score_ ",
+])
+def test_normalize_text_matches_regex(text):
+    from cs336_data.utils import normalize_text, normalize_text_regex
+
+    assert normalize_text(text) == normalize_text_regex(text)
+
+
+def test_sorted_jaccard_matches_ngram_sets():
+    from cs336_data.minhash import ngram_hash_array, sorted_jaccard
+    from cs336_data.utils import compute_ngrams, jaccard_distance, normalize_text
+
+    paths = sorted((FIXTURES_PATH / "documents_with_fuzzy_duplicates").glob("*.txt"))
+    texts = [normalize_text(path.read_text()) for path in paths]
+    for a in texts:
+        assert len(ngram_hash_array(a, 5)) == len(set(compute_ngrams(a, 5)))
+        for b in texts:
+            expected = jaccard_distance(set(compute_ngrams(a, 5)), set(compute_ngrams(b, 5)))
+            assert sorted_jaccard(ngram_hash_array(a, 5), ngram_hash_array(b, 5)) == pytest.approx(expected)
+    # Short texts are a single n-gram, and empty ones are not duplicates of each other
+    assert len(ngram_hash_array("abc", 5)) == 1
+    assert sorted_jaccard(ngram_hash_array("abc", 5), ngram_hash_array("abc", 5)) == 1.0
+    assert sorted_jaccard(ngram_hash_array("abc", 5), ngram_hash_array("abd", 5)) == 0.0
+    assert sorted_jaccard(ngram_hash_array("", 5), ngram_hash_array("", 5)) == 0.0
+
+
+@pytest.mark.parametrize("estimate_jaccard", [False, True])
+def test_minhash_deduplication_keeps_distinct_short_documents(tmp_path, estimate_jaccard):
+    from cs336_data.dedup import deduplicate_fuzzy
+
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    for name, text in [("a", "yes"), ("b", "no"), ("c", "ok"), ("d", "yes"), ("e", ""), ("f", "")]:
+        (input_dir / f"{name}.txt").write_text(text)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    deduplicate_fuzzy(sorted(input_dir.glob("*.txt")), 100, 20, 5, output_dir, 0.8, estimate_jaccard=estimate_jaccard)
+    output_names = {p.name for p in output_dir.glob("*")}
+    # Only one of the identical "yes" documents goes
+    assert len(output_names) == 5 and {"b.txt", "c.txt", "e.txt", "f.txt"} <= output_names
+
+
+def test_lsh_candidate_pairs_streams_large_bucket():
+    import tracemalloc
+    import numpy as np
+    from cs336_data.dedup import UnionFind
+    from cs336_data.dedup import lsh_candidate_pairs, verify_pairs
+
+    # 1500 identical signatures share every bucket: ~1.1M pairs per band if materialized
+    k, num_hashes = 1500, 8
+    signatures = np.zeros((k, num_hashes), dtype=np.uint64)
+    union_find = UnionFind(k)
+    tracemalloc.start()
+    verified = verify_pairs(lsh_candidate_pairs(signatures, 4, union_find), None, signatures, 5, 0.8, estimate_jaccard=True, union_find=union_find)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(verified) == k - 1
+    assert union_find.clusters() == [list(range(k))]
+    assert peak < 10 * 1024 * 1024
+
+
+def test_minhash_deduplication_skips_empty_documents(tmp_path, monkeypatch):
+    import json
+    import cs336_data.dedup as dedup
+    from cs336_data.minhash import minhash_signatures
+    from cs336_data.records import deduplicate_fuzzy_records
+
+    calls = []
+    sorted_jaccard = dedup.sorted_jaccard
+    monkeypatch.setattr(dedup, "sorted_jaccard", lambda a, b: calls.append(1) or sorted_jaccard(a, b))
+
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    texts = [""] * 200 + ["the same words over and over"] * 2
+    for i, text in enumerate(texts):
+        (input_dir / f"{i:03d}.txt").write_text(text)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    dedup.deduplicate_fuzzy(sorted(input_dir.glob("*.txt")), 100, 20, 5, output_dir, 0.8)
+    # Only the one nonempty pair is verified, not 20 bands of the 200 empty documents' pairs
+    assert len(calls) == 1
+    assert len(list(output_dir.glob("*"))) == 201
+
+    shard = tmp_path / "shard.jsonl"
+    shard.write_text("".join(json.dumps({"text": text}) + "\n" for text in texts))
+    records_dir = tmp_path / "records"
+    records_dir.mkdir()
+    calls.clear()
+    assert deduplicate_fuzzy_records([shard], records_dir, 100, 20, 5, 0.8) == {str(shard): 1}
+    assert len(calls) == 1
+
+    signatures = minhash_signatures([[]] * 50 + [["abcde"]] * 2, 100)
+    assert [(band, bucket.tolist()) for band, bucket in dedup.lsh_buckets(dedup.band_keys(signatures, 20), dedup.nonempty_rows(signatures))] == [(band, [50, 51]) for band in range(20)]
+
+
+def test_lsh_candidate_pairs_yields_a_pair_from_its_first_shared_band_only():
+    import numpy as np
+    from cs336_data.dedup import lsh_candidate_pairs
+
+    # Rows 0 and 1 share bands 1-3, rows 1 and 2 all four, rows 0 and 2 bands 1-3
+    signatures = np.array([[9, 9, 1, 1, 2, 2, 3, 3], [0, 0, 1, 1, 2, 2, 3, 3], [0, 0, 1, 1, 2, 2, 3, 3]], dtype=np.uint64)
+    assert sorted(lsh_candidate_pairs(signatures, 2)) == [(0, 1), (0, 2), (1, 2)]
@@ -15,3 +15,15 @@ def test_extract_text_from_html_bytes():
     with open(moby_expected_path) as f:
         moby_expected_text = f.read()
     assert moby_expected_text == run_extract_text_from_html_bytes(moby_bytes)
+
+
+def test_extract_text_encodings():
+    from cs336_data.utils import declared_charset, extract_text
+
+    html = "<html><body><p>Café crème, naïve façade</p></body></html>"
+    assert extract_text(html.encode("latin-1"), "text/html; charset=ISO-8859-1") == "Café crème, naïve façade"
+    assert extract_text(html.encode("utf-8")) == "Café crème, naïve façade"
+    assert extract_text(html.encode("utf-8"), "text/html; charset=bogus") == "Café crème, naïve façade"
+    assert extract_text("<p>Привет мир, как дела у вас сегодня?</p>".encode("cp1251") * 20).startswith("Привет мир")
+    assert declared_charset('text/html; Charset="UTF-8"') == "utf-8"
+    assert declared_charset("text/html") is None
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import time
+import logging
+
+from cs336_data.filters import FilterChain, FilterStage, classifier_stage, merge_profiles
+
+from .common import train_tiny_model
+
+logger = logging.getLogger(__name__)
+
+
+def slow_keep_all(contents, normalized):
+    time.sleep(0.001 * len(contents))
+    return [True] * len(contents)
+
+
+def fast_reject_odd(contents, normalized):
+    return [len(c) % 2 == 0 for c in contents]
+
+
+def test_filter_chain_reorders_cheap_rejecting_stage_first():
+    chain = FilterChain(
+        [FilterStage("slow", slow_keep_all), FilterStage("fast", fast_reject_odd)],
+        reorder_interval=10,
+        min_samples=5,
+    )
+    contents = ["a" * i for i in range(20)]
+    assert chain(contents) == [i % 2 == 0 for i in range(20)]
+    assert chain.order() == ["fast", "slow"]
+
+    # The reordered chain keeps the same documents but the slow stage only sees survivors
+    slow_docs = chain.stages[1].docs
+    assert chain(contents) == [i % 2 == 0 for i in range(20)]
+    assert chain.stages[1].docs - slow_docs == 10
+
+
+def test_filter_chain_profile_round_trip():
+    chain = FilterChain(
+        [FilterStage("slow", slow_keep_all), FilterStage("fast", fast_reject_odd)],
+        adaptive=False,
+    )
+    chain(["a", "aa", "aaa"])
+    profile = chain.profile()
+    assert profile["stages"]["fast"]["rejected"] == 2
+
+    seeded = FilterChain(
+        [FilterStage("fast", fast_reject_odd), FilterStage("slow", slow_keep_all)],
+        adaptive=False,
+    )
+    seeded.load_profile(profile)
+    assert seeded.order() == ["slow", "fast"]
+    seeded(["a", "aa"])
+    merged = merge_profiles([seeded.profile(), seeded.profile()], base=profile)
+    assert merged["stages"]["fast"]["docs"] == 3 + 2 * 2
+
+
+def test_classifier_stages_short_circuit(tmp_path):
+    from cs336_data.utils import classify_nsfw
+
+    model_path = train_tiny_model(tmp_path)
+    label, _ = classify_nsfw("hello world", model=model_path)
+    other = "__label__b" if label == "__label__a" else "__label__a"
+
+    scores = [{}]
+    assert FilterChain([classifier_stage(model_path, label, 0.0)], adaptive=False)(["hello world"], scores) == [True]
+    assert list(scores[0]) == [model_path]
+
+    # The second classifier must not run once the first one rejects
+    chain = FilterChain([classifier_stage(model_path, other, 0.0), classifier_stage("missing", None, 0.0)], adaptive=False)
+    assert chain(["hello world"]) == [False]
+    assert chain.stages[1].docs == 0
+
+    # A stage without an accepted label never rejects
+    chain = FilterChain([classifier_stage(model_path, None, 0.0)], adaptive=False)
+    assert chain(["hello world", "hello\nworld"]) == [True, True]
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import logging
+
+import pytest
+
+from cs336_data.utils import gopher_filters
+
+logger = logging.getLogger(__name__)
+
+ELLIPSIS_REJECT = "\n".join(
+    ["The line here is an example of line ending with an ellipsis..."] * 70
+    + ["This is a normal line."] * 30
+)
+ELLIPSIS_KEEP = "\n".join(
+    ["The line here is an example of ending with ellipsis..."] * 30
+    + ["This is a normal line."] * 230
+)
+
+CASES = [
+    ("This should definitely be a valid input text and of high quality according to Gopher rules. " * 100, True),
+    ("The string you are reading is a short snippet of text.", False),
+    ("The string you are reading is a long snippet of text." * 100, True),
+    ("The string you are reading is too long of a text. " * 50000, False),
+    ("The string you are reading is an okay example of text. " * 5000, True),
+    ("the be " * 100, False),
+    ("the with " * 100, True),
+    ("the and " + "extraordinarily extraordinarily extraordinarily longesest " * 100, False),
+    ("the and this is fine " * 100, True),
+    (ELLIPSIS_REJECT, False),
+    (ELLIPSIS_KEEP, True),
+]
+
+# Each of these passes every rule but one
+SINGLE_RULE_CASES = [
+    ("1234 5678 word " * 30, False),  # alphabetic words
+    ("1234 word word word word " * 20, True),
+    ("a b cd " * 30, False),  # mean word length
+    ("abc abc abc " * 30, True),
+    (ELLIPSIS_REJECT, False),  # lines ending with an ellipsis
+]
+
+
+@pytest.mark.parametrize("tokenizer", ["regex", "whitespace"])
+@pytest.mark.parametrize("text,expected", CASES + SINGLE_RULE_CASES)
+def test_gopher_fast_tokenizers(tokenizer, text, expected):
+    assert gopher_filters(text, tokenizer=tokenizer) == expected
+
+
+def test_gopher_fast_bails_out_on_huge_documents():
+    assert not gopher_filters("word " * 200000, tokenizer="regex")
+
+
+@pytest.mark.parametrize("text,expected", SINGLE_RULE_CASES, ids=["alpha", "alpha-keep", "length", "length-keep", "ellipsis"])
+def test_gopher_single_rule_cases_match_reference(text, expected):
+    assert gopher_filters(text) == expected
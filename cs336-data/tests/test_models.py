@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import os
+import logging
+
+from cs336_data.models import ModelCache
+
+from .common import train_tiny_model
+
+logger = logging.getLogger(__name__)
+
+
+def test_model_cache_hits_and_eviction(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"model{i}.bin"
+        path.write_text(str(i))
+        paths.append(path)
+    cache = ModelCache(maxsize=2, loader=lambda p: open(p).read())
+
+    assert cache.get(paths[0]) == "0"
+    assert cache.get(paths[0]) == "0"
+    assert cache.get(paths[1]) == "1"
+    assert cache.get(paths[2]) == "2"
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.currsize) == (1, 3, 1, 2)
+
+    # Rewriting the file bumps its mtime and invalidates the cached entry
+    paths[2].write_text("updated")
+    stat = os.stat(paths[2])
+    os.utime(paths[2], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert cache.get(paths[2]) == "updated"
+    assert cache.info().currsize == 2
+
+
+def test_batch_matches_single(tmp_path):
+    from cs336_data.utils import classify_nsfw, classify_nsfw_batch
+
+    model_path = train_tiny_model(tmp_path)
+    texts = ["hello world", "bar baz\nqux", "foo"]
+    batch = classify_nsfw_batch(texts, model=model_path)
+    assert len(batch) == len(texts)
+    for text, (label, score) in zip(texts, batch):
+        single_label, single_score = classify_nsfw(text, model=model_path)
+        assert label == single_label
+        assert abs(score - single_score) < 1e-5
+    assert classify_nsfw_batch([], model=model_path) == []
+
+
+def test_ensure_punkt_raises_when_download_fails(monkeypatch):
+    import nltk
+    import pytest
+    from cs336_data import models
+
+    def missing(name):
+        raise LookupError(name)
+
+    monkeypatch.setattr(models, "_punkt_ready", False)
+    monkeypatch.setattr(nltk.data, "find", missing)
+    monkeypatch.setattr(nltk, "download", lambda *args, **kwargs: False)
+    with pytest.raises(LookupError, match="Punkt"):
+        models.ensure_punkt()
+    assert not models._punkt_ready
+
+    # The old punkt data alone does not satisfy word_tokenize
+    downloads = []
+    monkeypatch.setattr(nltk.data, "find", lambda name: name if name == "tokenizers/punkt" else missing(name))
+    monkeypatch.setattr(nltk, "download", lambda name, **kwargs: downloads.append(name))
+    with pytest.raises(LookupError, match="Punkt"):
+        models.ensure_punkt()
+    assert downloads == ["punkt_tab"]
+
+    monkeypatch.setattr(nltk.data, "find", lambda name: name)
+    models.ensure_punkt()
+    assert models._punkt_ready
@@ -58,3 +58,23 @@ def test_mask_ips():
     masked_text, num_masked = run_mask_ips(test_string)
     assert masked_text == expected_masked_text
     assert num_masked == 1
+
+
+def test_mask_pii_single_pass_matches_sequential_maskers():
+    from cs336_data.utils import mask_pii
+
+    test_string = (
+        "Mail pl@fakedomain.ai or call 283-182-3829 from 192.0.2.146, "
+        "not from 192.168.10.100 or test@gmail.com."
+    )
+    expected, num_emails = run_mask_emails(test_string)
+    expected, num_phones = run_mask_phone_numbers(expected)
+    expected, num_ips = run_mask_ips(expected)
+    masked_text, counts = mask_pii(test_string)
+    assert masked_text == expected
+    assert counts == {"email": num_emails, "phone": num_phones, "ip": num_ips}
+
+    assert mask_pii("No personal information here.") == (
+        "No personal information here.",
+        {"email": 0, "phone": 0, "ip": 0},
+    )
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+import json
+import logging
+
+import pytest
+
+from cs336_data.filters import RecordFilter
+from cs336_data.run import RecordLimits, main, main_parallel, process_shard
+
+from .common import write_warc
+
+logger = logging.getLogger(__name__)
+
+
+def test_main_masks_and_reports_stats(tmp_path):
+    warc_path = tmp_path / "a.warc"
+    write_warc(warc_path, ["Contact me at test@gmail.com please.", "Nothing personal here."])
+    output_path = tmp_path / "out.txt"
+    stats_path = tmp_path / "stats.json"
+    main(False, True, False, False, str(warc_path), str(output_path), stats_path=str(stats_path))
+
+    output = output_path.read_text()
+    assert "|||EMAIL_ADDRESS|||" in output
+    assert "Nothing personal" not in output
+    with open(stats_path) as f:
+        stats = json.load(f)
+    assert stats["docs"] == 2
+    assert stats["stages"]["mask_pii"]["rejected"] == 1
+    assert sum(stats["latency_histogram"]["counts"]) == 2
+
+
+def test_main_parallel_writes_manifest(tmp_path, monkeypatch):
+    import cs336_data.run as run
+
+    input_dir = tmp_path / "warcs"
+    input_dir.mkdir()
+    for i in range(3):
+        write_warc(input_dir / f"{i}.warc", [f"Mail {i} to test@gmail.com now."] * (i + 1))
+    output_dir = tmp_path / "out"
+    reports = []
+    write_stats = run.write_stats
+    monkeypatch.setattr(run, "write_stats", lambda summary, path: reports.append(summary) or write_stats(summary, path))
+    manifest = main_parallel(False, True, False, False, str(input_dir), str(output_dir), num_workers=2, max_in_flight=2, stats_interval=0.0)
+
+    assert manifest["num_shards"] == 3
+    assert manifest["num_records"] == 6
+    assert manifest["num_kept"] == 6
+    assert manifest["stats"]["docs"] == 6
+    with open(output_dir / "manifest.json") as f:
+        assert json.load(f)["num_kept"] == 6
+    # Merged stats are written while shards run, and once more at the end
+    assert len(reports) >= 2 and all(r["docs"] <= 6 for r in reports)
+    with open(output_dir / "stats.json") as f:
+        assert json.load(f)["docs"] == 6
+
+
+def test_main_prefilters_records_on_headers(tmp_path):
+    warc_path = tmp_path / "a.warc"
+    bodies = [f"Mail {i} to test@gmail.com now." for i in range(5)]
+    write_warc(
+        warc_path, bodies,
+        urls=["http://example.com/0", "http://ads.spam.net/1", "http://example.com/2", "http://example.com/3", "http://example.com/4"],
+        content_types=["text/html", "text/html", "image/png", "text/html", "text/html; charset=utf-8"],
+        statuses=["200 OK", "200 OK", "200 OK", "404 Not Found", "200 OK"],
+    )
+    with open(warc_path, "ab") as f:
+        f.write(b"WARC/1.0\r\nWARC-Type: warcinfo\r\nWARC-Record-ID: <urn:uuid:1>\r\nContent-Length: 4\r\n\r\ninfo\r\n\r\n")
+    output_path = tmp_path / "out.txt"
+    stats_path = tmp_path / "stats.json"
+    result = process_shard(False, True, False, False, str(warc_path), str(output_path), progress=False, stats_path=str(stats_path), record_filter=RecordFilter(blocked_domains={"spam.net"}))
+    assert (result["num_records"], result["num_prefiltered"], result["num_kept"]) == (6, 4, 2)
+
+    output = output_path.read_text()
+    assert "Mail 0" in output and "Mail 4" in output
+    assert not any(f"Mail {i}" in output for i in (1, 2, 3))
+    with open(stats_path) as f:
+        stats = json.load(f)
+    assert stats["docs"] == 2
+    assert stats["stages"]["prefilter"]["rejected"] == 4
+    assert stats["counters"] == {"pii:email": 2, "pii:phone": 0, "pii:ip": 0, "prefilter:blocked_domain": 1, "prefilter:content_type": 1, "prefilter:status": 1, "prefilter:record_type": 1}
+
+
+def test_main_limits_truncate_and_skip(tmp_path):
+    warc_path = tmp_path / "a.warc"
+    write_warc(warc_path, ["Mail test@gmail.com " + "x" * 1000, "Mail test@gmail.com short"])
+    output_path = tmp_path / "out.txt"
+    stats_path = tmp_path / "stats.json"
+    main(False, True, False, False, str(warc_path), str(output_path), stats_path=str(stats_path), limits=RecordLimits(max_payload_bytes=200, max_text_chars=40))
+
+    output = output_path.read_text()
+    assert "x" * 40 not in output and "short" in output
+    with open(stats_path) as f:
+        counters = json.load(f)["counters"]
+    assert counters["limits:payload_truncated"] == 1
+    assert counters["limits:text_truncated"] == 1
+
+    main(False, True, False, False, str(warc_path), str(output_path), stats_path=str(stats_path), limits=RecordLimits(slow_record_seconds=0.0))
+    assert output_path.read_text() == ""
+    with open(stats_path) as f:
+        stats = json.load(f)
+    assert stats["counters"]["limits:slow_record"] == 2
+    assert stats["stages"]["slow_record"]["rejected"] == 2
+    # Past the deadline, reading stops and the record is never extracted
+    assert "extract_text" not in stats["stages"]
+
+
+def test_read_payload_stops_at_deadline():
+    import io
+    import time
+    from cs336_data import run
+
+    payload = b"x" * (3 * run.READ_CHUNK_BYTES + 5)
+    assert run.read_payload(io.BytesIO(payload)) == payload
+    assert run.read_payload(io.BytesIO(payload), 10, time.perf_counter() + 60) == payload[:10]
+    assert run.read_payload(io.BytesIO(payload), None, time.perf_counter() + 60) == payload
+    assert run.read_payload(io.BytesIO(payload), None, time.perf_counter() - 1) is None
+
+
+def test_main_writes_compressed_jsonl_shards(tmp_path):
+    from xopen import xopen
+
+    warc_path = tmp_path / "a.warc"
+    write_warc(warc_path, [f"Mail {i} to test@gmail.com now. " * 10 for i in range(6)])
+    output_prefix = tmp_path / "out"
+    main(False, True, False, False, str(warc_path), str(output_prefix), output_format="jsonl.gz", shard_bytes=1)
+
+    shards = sorted(tmp_path.glob("out-*.jsonl.gz"))
+    assert len(shards) == 1
+    with xopen(shards[0]) as f:
+        records = [json.loads(line) for line in f]
+    assert [r["url"] for r in records] == [f"http://example.com/{i}" for i in range(6)]
+    assert all(r["pii"]["email"] == 10 and r["text"].startswith("Mail") for r in records)
+
+
+def test_sharded_writer_rolls_over():
+    import io
+    from cs336_data.writers import ShardedWriter
+
+    class MemoryWriter(ShardedWriter):
+        def _open(self, path, append):
+            return io.StringIO()
+
+        def _write_batch(self, records):
+            return sum(len(r["text"]) for r in records)
+
+        def _close(self):
+            pass
+
+    writer = MemoryWriter("out", shard_bytes=8, buffer_records=2)
+    for i in range(7):
+        writer.write({"text": "x" * 4})
+    writer.close()
+    assert writer.paths == ["out-00000", "out-00001", "out-00002", "out-00003"]
+
+
+def test_unappendable_writer_checkpoints_between_shards(tmp_path):
+    from cs336_data.writers import ShardedWriter
+
+    class LineWriter(ShardedWriter):
+        def _open(self, path, append):
+            return open(path, "w")
+
+        def _write_batch(self, records):
+            self._file.writelines(r["text"] + "\n" for r in records)
+            return sum(len(r["text"]) for r in records)
+
+        def _close(self):
+            self._file.close()
+
+    writer = LineWriter(str(tmp_path / "out"), shard_bytes=8, buffer_records=2)
+    for text in ["aaaa", "bb"]:
+        writer.write({"text": text})
+    assert not writer.can_checkpoint
+    with pytest.raises(RuntimeError):
+        writer.checkpoint()
+    for text in ["cccc", "dddd", "e"]:
+        writer.write({"text": text})
+    # The first shard has rolled over; the buffered record goes into the state unwritten
+    assert writer.can_checkpoint
+    state = writer.checkpoint()
+    assert [r["text"] for r in state["buffer"]] == ["e"]
+    writer.write({"text": "lost"})
+    writer.close()
+
+    resumed = LineWriter(str(tmp_path / "out"), shard_bytes=8, buffer_records=2)
+    resumed.restore(state)
+    resumed.close()
+    assert [open(path).read() for path in resumed.paths] == ["aaaa\nbb\ncccc\ndddd\n", "e\n"]
+
+
+@pytest.mark.parametrize("output_format", ["text", "jsonl.gz"])
+def test_process_shard_resumes_from_checkpoint(tmp_path, monkeypatch, output_format):
+    from xopen import xopen
+    import cs336_data.run as run
+
+    warc_path = tmp_path / "a.warc"
+    write_warc(warc_path, [f"Mail {i} to test@gmail.com now." for i in range(7)])
+    expected = run.process_shard(False, True, False, False, str(warc_path), str(tmp_path / "expected"), progress=False, batch_size=2, output_format=output_format)
+
+    extract_text = run.extract_text
+    calls = []
+
+    def crash_on_seventh_record(payload, content_type=None):
+        calls.append(payload)
+        if len(calls) == 7:
+            raise KeyboardInterrupt
+        return extract_text(payload, content_type)
+
+    # Keep only the checkpoints before records 0, 2 and 4, so that records 4 and 5 are
+    # written after the last checkpoint and must be dropped from the output on resume
+    save_checkpoint = run.save_checkpoint
+    saved = []
+
+    def save_first_checkpoints(checkpoint, path):
+        saved.append(checkpoint)
+        if len(saved) <= 3:
+            save_checkpoint(checkpoint, path)
+
+    output_path = str(tmp_path / "out")
+    monkeypatch.setattr(run, "extract_text", crash_on_seventh_record)
+    monkeypatch.setattr(run, "save_checkpoint", save_first_checkpoints)
+    with pytest.raises(KeyboardInterrupt):
+        run.process_shard(False, True, False, False, str(warc_path), output_path, progress=False, batch_size=2, output_format=output_format, shard_bytes=1, checkpoint_interval=0.0)
+    assert len(saved) == 4
+    monkeypatch.setattr(run, "extract_text", extract_text)
+    monkeypatch.setattr(run, "save_checkpoint", save_checkpoint)
+    result = run.process_shard(False, True, False, False, str(warc_path), output_path, progress=False, batch_size=2, output_format=output_format, shard_bytes=1, checkpoint_interval=0.0)
+
+    assert result["num_records"] == 7 and result["num_kept"] == 7
+    assert result["stats"]["docs"] == 7
+    read = lambda paths: "".join(xopen(path).read() for path in paths)
+    assert read(result["output_paths"]) == read(expected["output_paths"])
+    # A completed shard is not processed again
+    monkeypatch.setattr(run, "extract_text", crash_on_seventh_record)
+    assert run.process_shard(False, True, False, False, str(warc_path), output_path, progress=False, batch_size=2, output_format=output_format, shard_bytes=1, checkpoint_interval=0.0)["num_kept"] == 7
+    # Nor resumed with arguments that change the output
+    with pytest.raises(ValueError, match="gopher_tokenizer, limits"):
+        run.process_shard(False, True, False, False, str(warc_path), output_path, progress=False, output_format=output_format, shard_bytes=1, checkpoint_interval=0.0, gopher_tokenizer="regex", limits=RecordLimits(max_text_chars=10))
+
+
+def test_filter_batch_keeps_order_and_masks_survivors():
+    from cs336_data.filters import FilterChain, FilterStage, filter_batch
+
+    seen = []
+
+    def reject_odd(contents, normalized):
+        return [len(c) % 2 == 0 for c in contents], [float(len(c)) for c in contents]
+
+    def record_survivors(contents, normalized):
+        seen.extend(contents)
+        return [True] * len(contents)
+
+    chain = FilterChain([FilterStage("even", reject_odd), FilterStage("record", record_survivors)], adaptive=False)
+    contents = ["mail a@b.co", "mail a@b.com", "no pii here!", "x@y.io"]
+    metadata = [{} for _ in contents]
+    outputs = filter_batch(contents, chain, mask_pii=True, metadata=metadata)
+
+    # The second stage only sees the survivors of the first, and documents without PII are dropped
+    assert seen == ["mail a@b.com", "no pii here!", "x@y.io"]
+    assert outputs == [None, "mail |||EMAIL_ADDRESS|||", None, "|||EMAIL_ADDRESS|||"]
+    assert metadata[1] == {"scores": {"even": 12.0}, "pii": {"email": 1, "phone": 0, "ip": 0}}
+    assert metadata[0] == {} and metadata[2] == {}
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 64])
+def test_process_shard_output_is_independent_of_batch_size(tmp_path, batch_size):
+    warc_path = tmp_path / "a.warc"
+    write_warc(warc_path, [f"Mail {i} to test@gmail.com now." if i % 3 else f"Nothing {i} here." for i in range(10)])
+    result = process_shard(False, True, False, False, str(warc_path), str(tmp_path / "out.txt"), progress=False, batch_size=batch_size)
+    expected = process_shard(False, True, False, False, str(warc_path), str(tmp_path / "single.txt"), progress=False, batch_size=10)
+
+    assert (result["num_records"], result["num_kept"]) == (10, 6)
+    assert (tmp_path / "out.txt").read_text() == (tmp_path / "single.txt").read_text()
+    assert result["stats"]["docs"] == expected["stats"]["docs"] == 10